@@ -20,13 +20,16 @@ default config for pgbouncer.
 
 """
 
+import hmac
 import logging
+import re
 import secrets
 import string
-from hashlib import md5
-from typing import Dict
-
-from psycopg2 import extensions
+import stringprep
+import unicodedata
+from base64 import b64encode
+from hashlib import md5, pbkdf2_hmac, sha256
+from typing import Dict, Iterator, Optional, Set, Tuple
 
 # The unique Charmhub library identifier, never change it
 LIBID = "113f4a7480c04631bfdf5fe776f760cd"
@@ -34,7 +37,7 @@ LIBID = "113f4a7480c04631bfdf5fe776f760cd"
 LIBAPI = 0
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 11
+LIBPATCH = 13
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +45,13 @@ PGB = "pgbouncer"
 PGB_DIR = "/var/lib/postgresql/pgbouncer"
 INI_PATH = f"{PGB_DIR}/pgbouncer.ini"
 
+# Same defaults as PostgreSQL's scram_build_secret()
+SCRAM_ITERATIONS = 4096
+SCRAM_SALT_LENGTH = 16
+
+# A `"username" "password"` auth_file line, where double quotes are escaped by doubling them
+USERLIST_LINE = re.compile(r'^\s*"((?:[^"]|"")*)"\s+"((?:[^"]|"")*)"')
+
 
 def parse_kv_string_to_dict(string: str) -> Dict[str, str]:
     """Parses space-separated key=value pairs into a python dict.
@@ -93,6 +103,152 @@ def get_md5_password(username: str, password: str) -> str:
     return f"md5{md5((password + username).encode()).hexdigest()}"  # noqa: S324
 
 
-def get_scram_password(username: str, password: str, connection) -> str:
-    """Creates an SCRAM SHA 256 hashed password for the given user, in the format postgresql expects."""
-    return extensions.encrypt_password(password, username, connection, "scram-sha-256")
+def _saslprep(password: str) -> str:
+    """Normalises a password with SASLprep (RFC 4013), the way PostgreSQL does.
+
+    Like PostgreSQL, the password is used as is when it is not valid UTF-8 SASLprep input, e.g.
+    because it contains prohibited or unassigned characters.
+    """
+    if password.isascii():
+        return password
+
+    mapped = "".join(
+        " " if stringprep.in_table_c12(char) else char
+        for char in password
+        if not stringprep.in_table_b1(char)
+    )
+    normalised = unicodedata.normalize("NFKC", mapped)
+    if not normalised:
+        return password
+
+    prohibited = (
+        stringprep.in_table_a1,
+        stringprep.in_table_c12,
+        stringprep.in_table_c21_c22,
+        stringprep.in_table_c3,
+        stringprep.in_table_c4,
+        stringprep.in_table_c5,
+        stringprep.in_table_c6,
+        stringprep.in_table_c7,
+        stringprep.in_table_c8,
+        stringprep.in_table_c9,
+    )
+    if any(check(char) for char in normalised for check in prohibited):
+        return password
+
+    # Bidirectional strings must start and end with a RandALCat character and have no LCat ones
+    if any(stringprep.in_table_d1(char) for char in normalised) and (
+        not stringprep.in_table_d1(normalised[0])
+        or not stringprep.in_table_d1(normalised[-1])
+        or any(stringprep.in_table_d2(char) for char in normalised)
+    ):
+        return password
+    return normalised
+
+
+def get_scram_password(
+    username: str, password: str, connection=None, salt: Optional[bytes] = None
+) -> str:
+    """Creates an SCRAM SHA 256 hashed password for the given user, in the format postgresql expects.
+
+    The verifier is computed locally and matches the output of PostgreSQL's
+    `scram_build_secret()`, so no database round trip is needed.
+
+    Args:
+        username: unused, SCRAM verifiers don't depend on the user name. Kept for compatibility.
+        password: the plaintext password.
+        connection: unused. Kept for compatibility with LIBPATCH < 12.
+        salt: the salt to use, a random one by default.
+
+    Returns:
+        A string in the `SCRAM-SHA-256$<iterations>:<salt>$<StoredKey>:<ServerKey>` format.
+    """
+    if salt is None:
+        salt = secrets.token_bytes(SCRAM_SALT_LENGTH)
+    salted_password = pbkdf2_hmac("sha256", _saslprep(password).encode(), salt, SCRAM_ITERATIONS)
+    client_key = hmac.new(salted_password, b"Client Key", sha256).digest()
+    stored_key = sha256(client_key).digest()
+    server_key = hmac.new(salted_password, b"Server Key", sha256).digest()
+    return (
+        f"SCRAM-SHA-256${SCRAM_ITERATIONS}:{b64encode(salt).decode()}"
+        f"${b64encode(stored_key).decode()}:{b64encode(server_key).decode()}"
+    )
+
+
+class UserList:
+    """The entries of a pgbouncer auth_file, keyed by user name.
+
+    Entries keep their insertion order, so that serialising an unchanged userlist gives back the
+    same content.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, str]] = None):
+        self._entries = dict(entries or {})
+
+    @classmethod
+    def parse(cls, content: str) -> "UserList":
+        """Parses the content of an auth_file.
+
+        Raises:
+            ValueError: if a non-empty line is not a valid auth_file entry.
+        """
+        entries = {}
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            if not (match := USERLIST_LINE.match(line)):
+                raise ValueError(f"Invalid auth_file line: {line}")
+            entries[match[1].replace('""', '"')] = match[2].replace('""', '"')
+        return cls(entries)
+
+    def __str__(self) -> str:
+        """Serialises the entries in the auth_file format."""
+        return "\n".join(
+            " ".join('"{}"'.format(value.replace('"', '""')) for value in entry)
+            for entry in self._entries.items()
+        )
+
+    def __contains__(self, user: object) -> bool:
+        """Whether the given user has an entry."""
+        return user in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterates over the user names."""
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        """Number of entries."""
+        return len(self._entries)
+
+    def __eq__(self, other: object) -> bool:
+        """Userlists are equal when they have the same entries."""
+        if not isinstance(other, UserList):
+            return NotImplemented
+        return self._entries == other._entries
+
+    def get(self, user: str) -> Optional[str]:
+        """Returns the password hash of the given user, if present."""
+        return self._entries.get(user)
+
+    def add(self, user: str, password: str) -> None:
+        """Adds the given user, replacing its password hash if already present."""
+        self._entries[user] = password
+
+    def remove(self, user: str) -> None:
+        """Removes the given user, if present."""
+        self._entries.pop(user, None)
+
+    def diff(self, other: "UserList") -> Tuple[Set[str], Set[str], Set[str]]:
+        """Compares this userlist to a newer one.
+
+        Returns:
+            The users added, removed and whose password hash changed in the other userlist.
+        """
+        added = other._entries.keys() - self._entries.keys()
+        removed = self._entries.keys() - other._entries.keys()
+        changed = {
+            user
+            for user in self._entries.keys() & other._entries.keys()
+            if self._entries[user] != other._entries[user]
+        }
+        return added, removed, changed
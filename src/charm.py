@@ -11,11 +11,14 @@ import math
 import os
 import platform
 import pwd
+import select
 import shutil
 import subprocess
 import sys
+import time
 from configparser import ConfigParser
-from typing import Dict, List, Literal, Optional, Union, get_args
+from functools import cached_property
+from typing import Dict, List, Literal, Optional, Tuple, Union, get_args
 
 if sys.version_info < (3, 9):
     from utils import _remove_stale_otel_sdk_packages
@@ -32,11 +35,12 @@ from charms.data_platform_libs.v0.data_models import TypedCharmBase
 from charms.grafana_agent.v0.cos_agent import COSAgentProvider, ProtocolNotFoundError
 from charms.operator_libs_linux.v1 import systemd
 from charms.operator_libs_linux.v2 import snap
-from charms.pgbouncer_k8s.v0.pgb import generate_password
+from charms.pgbouncer_k8s.v0.pgb import UserList, generate_password, parse_kv_string_to_dict
 from charms.postgresql_k8s.v0.postgresql import PERMISSIONS_GROUP_ADMIN
 from charms.postgresql_k8s.v0.postgresql_tls import PostgreSQLTLS
 from jinja2 import Template
 from ops import (
+    ActionEvent,
     ActiveStatus,
     BlockedStatus,
     JujuVersion,
@@ -53,23 +57,39 @@ from single_kernel_postgresql.compat.postgresql import (
     INVALID_DATABASE_NAME_BLOCKING_MESSAGE,
     INVALID_EXTRA_USER_ROLE_BLOCKING_MESSAGE,
 )
+from tenacity import RetryError, Retrying, stop_after_delay, wait_fixed
 
 from config import CharmConfig
 from constants import (
+    ADMIN_PASSWORD_KEY,
     APP_SCOPE,
     AUTH_FILE_DATABAG_KEY,
     CFG_FILE_DATABAG_KEY,
     CLIENT_RELATION_NAME,
     EXTENSIONS_BLOCKING_MESSAGE,
+    INSTANCE_SKEW_MIN_CLIENTS,
+    INSTANCE_SKEW_MIN_CPU,
+    LOGROTATE_INTERVAL,
     MONITORING_PASSWORD_KEY,
     PEER_RELATION_NAME,
     PG_USER,
     PGB,
     PGB_CONF_DIR,
+    PGB_CONNECT_TIMEOUT,
+    PGB_CPU_SAMPLE_INTERVAL,
+    PGB_DRAIN_TIMEOUT,
+    PGB_FD_LIMIT,
+    PGB_FD_RESERVE,
     PGB_LOG_DIR,
+    PGB_MEMORY_SHARE,
+    PGB_PREWARM_TIMEOUT,
     PGB_RUN_DIR,
     PGBOUNCER_EXECUTABLE,
     PGBOUNCER_SNAP_NAME,
+    READONLY_GROUP_SUFFIX,
+    READONLY_HOSTS_KEY,
+    READONLY_MAX_WEIGHT,
+    READONLY_WEIGHTS_KEY,
     SECRET_DELETED_LABEL,
     SECRET_INTERNAL_LABEL,
     SECRET_KEY_OVERRIDES,
@@ -149,6 +169,11 @@ class PgBouncerCharm(TypedCharmBase):
         self.framework.observe(self.on.config_changed, self._on_config_changed)
         self.framework.observe(self.on.update_status, self._on_update_status)
         self.framework.observe(self.on.secret_remove, self._on_secret_remove)
+        self.framework.observe(
+            self.on.get_connection_limits_action, self._on_get_connection_limits
+        )
+        self.framework.observe(self.on.prewarm_pools_action, self._on_prewarm_pools)
+        self.framework.observe(self.on.rebalance_instances_action, self._on_rebalance_instances)
 
         self.peers = Peers(self)
         self.backend = BackendDatabaseRequires(self)
@@ -159,17 +184,13 @@ class PgBouncerCharm(TypedCharmBase):
         self.hacluster = HaCluster(self)
 
         self.service_ids = list(range(self.instances_count))
-        self.pgb_services = [
-            f"{PGB}-{self.app.name}@{service_id}" for service_id in self.service_ids
-        ]
+        self.readonly_service_ids = list(range(self.readonly_instances_count))
 
         try:
             self._grafana_agent = COSAgentProvider(
                 self,
-                metrics_endpoints=[
-                    {"path": "/metrics", "port": self.config.metrics_port},
-                ],
-                log_slots=[f"{PGBOUNCER_SNAP_NAME}:logs"],
+                scrape_configs=self._metrics_scrape_configs,
+                log_slots=self._log_slots,
                 refresh_events=[self.on.config_changed],
                 tracing_protocols=[TRACING_PROTOCOL],
             )
@@ -187,9 +208,19 @@ class PgBouncerCharm(TypedCharmBase):
         )
 
     @property
-    def instances_count(self):
-        """Returns the amount of instances to spin based on expose."""
-        if self._is_exposed:
+    def instances_count(self) -> int:
+        """Returns the amount of instances to spin based on config and expose."""
+        try:
+            instances_count = self.config.instances_count
+            local_connection_type = self.config.local_connection_type
+        except ValueError:
+            instances_count = "auto"
+            local_connection_type = "tcp"
+        if instances_count != "auto":
+            return instances_count
+
+        # Unix socket clients are spread over the per-instance sockets
+        if self._is_exposed or local_connection_type == "uds":
             return max(min(os.cpu_count(), 4), 2)
         else:
             return 1
@@ -213,6 +244,53 @@ class PgBouncerCharm(TypedCharmBase):
         """Returns whether the unit is in a blocked state."""
         return isinstance(self.unit.status, BlockedStatus)
 
+    @property
+    def readonly_instances_count(self) -> int:
+        """Returns the amount of readonly listener instances, 0 when the listener is disabled."""
+        try:
+            if not self.config.readonly_listen_port:
+                return 0
+            return self.config.readonly_instances_count
+        except ValueError:
+            return 0
+
+    @property
+    def instance_groups(self) -> Dict[str, List[int]]:
+        """Service ids of the pgbouncer instance groups, keyed by group name.
+
+        The readonly group is always listed, with no ids when disabled, so that its instances
+        are cleaned up when the listener is turned off.
+        """
+        return {
+            self.app.name: self.service_ids,
+            f"{self.app.name}{READONLY_GROUP_SUFFIX}": self.readonly_service_ids,
+        }
+
+    @property
+    def pgb_services(self) -> List[str]:
+        """Systemd units of the pgbouncer instances of every group."""
+        return [
+            f"{PGB}-{group}@{service_id}"
+            for group, service_ids in self.instance_groups.items()
+            for service_id in service_ids
+        ]
+
+    @property
+    def exporter_services(self) -> List[str]:
+        """Systemd units of the prometheus exporters, one per pgbouncer instance."""
+        return [
+            f"{PGB}-{group}-prometheus@{service_id}"
+            for group, service_ids in self.instance_groups.items()
+            for service_id in service_ids
+        ]
+
+    @property
+    def listen_ports(self) -> List[int]:
+        """Ports pgbouncer listens on."""
+        if self.readonly_service_ids:
+            return [self.config.listen_port, self.config.readonly_listen_port]
+        return [self.config.listen_port]
+
     # =======================
     #  Charm Lifecycle Hooks
     # =======================
@@ -220,48 +298,248 @@ class PgBouncerCharm(TypedCharmBase):
     def create_instance_directories(self):
         """Create configuration directories for pgbouncer instances."""
         pg_user = pwd.getpwnam(PG_USER)
-        app_conf_dir = f"{PGB_CONF_DIR}/{self.app.name}"
-        app_run_dir = f"{PGB_RUN_DIR}/{self.app.name}"
 
         # Make a directory for each service to store configs.
-        for service_id in self.service_ids:
-            os.makedirs(f"{app_conf_dir}/{INSTANCE_DIR}{service_id}", 0o700, exist_ok=True)
-            os.chown(f"{app_conf_dir}/{INSTANCE_DIR}{service_id}", pg_user.pw_uid, pg_user.pw_gid)
-            os.makedirs(f"{app_run_dir}/{INSTANCE_DIR}{service_id}", 0o777, exist_ok=True)
-            os.chown(f"{app_run_dir}/{INSTANCE_DIR}{service_id}", pg_user.pw_uid, pg_user.pw_gid)
+        for group, service_ids in self.instance_groups.items():
+            group_conf_dir = f"{PGB_CONF_DIR}/{group}"
+            group_run_dir = f"{PGB_RUN_DIR}/{group}"
+            for service_id in service_ids:
+                os.makedirs(f"{group_conf_dir}/{INSTANCE_DIR}{service_id}", 0o700, exist_ok=True)
+                os.chown(
+                    f"{group_conf_dir}/{INSTANCE_DIR}{service_id}", pg_user.pw_uid, pg_user.pw_gid
+                )
+                os.makedirs(f"{group_run_dir}/{INSTANCE_DIR}{service_id}", 0o777, exist_ok=True)
+                os.chown(
+                    f"{group_run_dir}/{INSTANCE_DIR}{service_id}", pg_user.pw_uid, pg_user.pw_gid
+                )
+
+    def update_instances(self) -> bool:
+        """Match the instances on the unit to the configured instance count.
+
+        Stops the instances that are no longer needed and creates the directories and utility
+        files for new ones. New instances are started on the next config reload.
+
+        Returns:
+            Whether the set of instances changed.
+        """
+        if not os.path.isdir(f"{PGB_CONF_DIR}/{self.app.name}"):
+            return False
+
+        changed = False
+        for group, service_ids in self.instance_groups.items():
+            group_conf_dir = f"{PGB_CONF_DIR}/{group}"
+            existing_ids = set()
+            if os.path.isdir(group_conf_dir):
+                existing_ids = {
+                    int(entry[len(INSTANCE_DIR) :])
+                    for entry in os.listdir(group_conf_dir)
+                    if entry.startswith(INSTANCE_DIR) and entry[len(INSTANCE_DIR) :].isdigit()
+                }
+            for service_id in sorted(existing_ids - set(service_ids)):
+                service = f"{PGB}-{group}@{service_id}"
+                logger.info(f"stopping surplus {service}")
+                try:
+                    systemd.service_stop(f"{PGB}-{group}-prometheus@{service_id}")
+                    systemd.service_stop(service)
+                except systemd.SystemdError as e:
+                    logger.error(e)
+                shutil.rmtree(f"{group_conf_dir}/{INSTANCE_DIR}{service_id}", ignore_errors=True)
+                shutil.rmtree(
+                    os.path.dirname(self._cpu_affinity_file(service_id, group)),
+                    ignore_errors=True,
+                )
+            changed = changed or existing_ids != set(service_ids)
+            if not service_ids:
+                # The group may have been disabled in an earlier hook, or by an older revision
+                changed = self._remove_instance_group(group) or changed
+
+        if not changed:
+            return False
+
+        self.create_instance_directories()
+        self.render_utility_files()
+        return True
+
+    def _remove_instance_group(self, group: str) -> bool:
+        """Removes the template unit and the directories of an instance group without instances.
+
+        Returns:
+            Whether the template unit was still installed, so that systemd needs a reload.
+        """
+        removed = False
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f"/etc/systemd/system/{PGB}-{group}@.service")
+            removed = True
+        shutil.rmtree(f"/etc/systemd/system/{PGB}-{group}@.service.d", ignore_errors=True)
+        for path in [PGB_CONF_DIR, PGB_LOG_DIR, PGB_RUN_DIR, SNAP_TMP_DIR]:
+            shutil.rmtree(f"{path}/{group}", ignore_errors=True)
+        return removed
 
     @property
     def tracing_endpoint(self) -> Optional[str]:
         """Otlp http endpoint for charm instrumentation."""
         return self._tracing_endpoint_config
 
+    def _cpu_affinity_file(self, service_id: int, group: Optional[str] = None) -> str:
+        """Path of the systemd drop-in pinning the given instance to a CPU core."""
+        group = group or self.app.name
+        return f"/etc/systemd/system/{PGB}-{group}@{service_id}.service.d/cpu-affinity.conf"
+
+    def render_cpu_affinity(self) -> bool:
+        """Render or remove the CPUAffinity drop-ins of the pgbouncer instances.
+
+        Returns:
+            Whether any drop-in was changed, so that the instances need a restart.
+        """
+        try:
+            cpu_affinity = self.config.cpu_affinity
+        except ValueError:
+            return False
+
+        changed = False
+        # Readonly instances are pinned to the cores following the primary instances
+        instances = [
+            (group, service_id)
+            for group, service_ids in self.instance_groups.items()
+            for service_id in service_ids
+        ]
+        for core, (group, service_id) in enumerate(instances):
+            path = self._cpu_affinity_file(service_id, group)
+            if cpu_affinity:
+                content = f"[Service]\nCPUAffinity={core % (os.cpu_count() or 1)}\n"
+                if os.path.exists(path):
+                    with open(path) as file:
+                        if file.read() == content:
+                            continue
+                os.makedirs(os.path.dirname(path), 0o755, exist_ok=True)
+                self.render_file(path, content, perms=0o644)
+                changed = True
+            elif os.path.exists(path):
+                self.delete_file(path)
+                changed = True
+
+        if changed:
+            systemd.daemon_reload()
+        return changed
+
+    def _log_sink_file(self, group: str) -> str:
+        """Path of the systemd drop-in routing the output of the group instances."""
+        return f"/etc/systemd/system/{PGB}-{group}@.service.d/log-sink.conf"
+
+    def render_log_sink(self) -> bool:
+        """Render or remove the drop-ins routing the pgbouncer output to the journal.
+
+        Instances logging to syslog have their output discarded, since it would reach syslog a
+        second time through the journal.
+
+        Returns:
+            Whether any drop-in was changed, so that the instances need a restart.
+        """
+        try:
+            log_sink = self.config.log_sink
+        except ValueError:
+            return False
+
+        changed = False
+        for group, service_ids in self.instance_groups.items():
+            path = self._log_sink_file(group)
+            if service_ids and log_sink == "journald":
+                content = f"[Service]\nStandardError=journal\nSyslogIdentifier={PGB}-{group}-%i\n"
+            elif service_ids and log_sink == "syslog":
+                content = "[Service]\nStandardOutput=null\nStandardError=null\n"
+            else:
+                if os.path.exists(path):
+                    self.delete_file(path)
+                    changed = True
+                continue
+            os.makedirs(os.path.dirname(path), 0o755, exist_ok=True)
+            changed = self.render_file_if_changed(path, content, perms=0o644) or changed
+
+        if changed:
+            systemd.daemon_reload()
+        return changed
+
     def render_utility_files(self):
         """Render charm utility services and configuration."""
-        # Render pgbouncer service file and reload systemd
+        # Render pgbouncer service files and reload systemd
         with open("templates/pgbouncer.service.j2") as file:
             template = Template(file.read())
-        # Render the template file with the correct values.
-        rendered = template.render(
-            app_name=self.app.name, conf_dir=PGB_CONF_DIR, snap_tmp_dir=SNAP_TMP_DIR
-        )
-
-        self.render_file(
-            f"/etc/systemd/system/{PGB}-{self.app.name}@.service", rendered, perms=0o644
-        )
+        for group, service_ids in self.instance_groups.items():
+            if not service_ids:
+                self.delete_file(f"/etc/systemd/system/{PGB}-{group}@.service")
+                continue
+            # Render the template file with the correct values.
+            rendered = template.render(
+                app_name=group,
+                conf_dir=PGB_CONF_DIR,
+                snap_tmp_dir=SNAP_TMP_DIR,
+                fd_limit=PGB_FD_LIMIT,
+            )
+            self.render_file(f"/etc/systemd/system/{PGB}-{group}@.service", rendered, perms=0o644)
         systemd.daemon_reload()
-        # Render the logrotate config
-        with open("templates/logrotate.j2") as file:
-            template = Template(file.read())
-        # Logrotate expects the file to be owned by root
-        with open(f"/etc/logrotate.d/{PGB}-{self.app.name}", "w+") as file:
-            file.write(
-                template.render(
-                    log_dir=PGB_LOG_DIR,
-                    app_name=self.app.name,
-                    service_ids=self.service_ids,
-                    prefix=PGB,
+        self.render_cpu_affinity()
+        self.render_log_sink()
+        self.render_logrotate()
+
+    def render_logrotate(self) -> None:
+        """Render the logrotate config and the timer checking the log sizes against it.
+
+        The system logrotate only runs daily, too seldom for the size threshold to hold back
+        the logs of busy instances. Quiet instances don't log enough for it to matter, so the
+        timer is stopped for them. Neither is needed when the instances don't log to files.
+        """
+        try:
+            max_size = self.config.log_max_size
+            retention = self.config.log_retention
+            quiet = self.config.log_mode == "quiet"
+            log_to_file = self.config.log_sink == "file"
+        except ValueError:
+            return
+
+        config = f"/etc/logrotate.d/{PGB}-{self.app.name}"
+        if log_to_file:
+            with open("templates/logrotate.j2") as file:
+                template = Template(file.read())
+            # Logrotate expects the file to be owned by root
+            with open(config, "w+") as file:
+                file.write(
+                    template.render(
+                        log_dir=PGB_LOG_DIR,
+                        groups=[group for group, ids in self.instance_groups.items() if ids],
+                        services=self.pgb_services,
+                        max_size=max_size,
+                        retention=retention,
+                    )
+                )
+        else:
+            self.delete_file(config)
+
+        timer = f"{PGB}-{self.app.name}-logrotate"
+        if quiet or not log_to_file:
+            with contextlib.suppress(systemd.SystemdError):
+                systemd.service_disable("--now", f"{timer}.timer")
+            return
+
+        changed = False
+        for unit_type in ["service", "timer"]:
+            with open(f"templates/logrotate.{unit_type}.j2") as file:
+                template = Template(file.read())
+            rendered = template.render(
+                app_name=self.app.name, config=config, interval=LOGROTATE_INTERVAL
+            )
+            changed = (
+                self.render_file_if_changed(
+                    f"/etc/systemd/system/{timer}.{unit_type}", rendered, perms=0o644
                 )
+                or changed
             )
+        if changed:
+            systemd.daemon_reload()
+        if changed or not systemd.service_running(f"{timer}.timer"):
+            try:
+                systemd.service_enable("--now", f"{timer}.timer")
+            except systemd.SystemdError as e:
+                logger.error(e)
 
     def _on_install(self, _) -> None:
         """On install hook.
@@ -290,11 +568,17 @@ class PgBouncerCharm(TypedCharmBase):
         self.unit.status = WaitingStatus("Waiting to start PgBouncer")
 
     def remove_exporter_service(self) -> None:
-        """Stops and removes the pgbouncer_exporter service if it exists."""
-        prom_service = f"{PGB}-{self.app.name}-prometheus"
-        with contextlib.suppress(systemd.SystemdError, FileNotFoundError):
-            systemd.service_stop(prom_service)
-            os.remove(f"/etc/systemd/system/{prom_service}.service")
+        """Stops and removes the pgbouncer_exporter services if they exist."""
+        # Older revisions ran a single exporter for the whole unit
+        for service in [*self.exporter_services, f"{PGB}-{self.app.name}-prometheus"]:
+            with contextlib.suppress(systemd.SystemdError):
+                systemd.service_stop(service)
+        for unit_file in [
+            *[f"{PGB}-{group}-prometheus@.service" for group in self.instance_groups],
+            f"{PGB}-{self.app.name}-prometheus.service",
+        ]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(f"/etc/systemd/system/{unit_file}")
 
     def _on_remove(self, _) -> None:
         """On Remove hook.
@@ -305,13 +589,26 @@ class PgBouncerCharm(TypedCharmBase):
             systemd.service_stop(service)
 
         os.remove(f"/etc/systemd/system/{PGB}-{self.app.name}@.service")
+        for group, service_ids in self.instance_groups.items():
+            for service_id in service_ids:
+                with contextlib.suppress(FileNotFoundError):
+                    shutil.rmtree(os.path.dirname(self._cpu_affinity_file(service_id, group)))
+            shutil.rmtree(os.path.dirname(self._log_sink_file(group)), ignore_errors=True)
         self.remove_exporter_service()
-        os.remove(f"/etc/logrotate.d/{PGB}-{self.app.name}")
+        self.delete_file(f"/etc/logrotate.d/{PGB}-{self.app.name}")
+        timer = f"{PGB}-{self.app.name}-logrotate"
+        with contextlib.suppress(systemd.SystemdError):
+            systemd.service_disable("--now", f"{timer}.timer")
+        for unit_type in ["service", "timer"]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(f"/etc/systemd/system/{timer}.{unit_type}")
 
         shutil.rmtree(f"{PGB_CONF_DIR}/{self.app.name}")
         shutil.rmtree(f"{PGB_LOG_DIR}/{self.app.name}")
         shutil.rmtree(f"{PGB_RUN_DIR}/{self.app.name}")
         shutil.rmtree(f"{SNAP_TMP_DIR}/{self.app.name}")
+        # Left behind if the read-only instances were disabled before the removal
+        self._remove_instance_group(f"{self.app.name}{READONLY_GROUP_SUFFIX}")
 
         systemd.daemon_reload()
 
@@ -332,9 +629,13 @@ class PgBouncerCharm(TypedCharmBase):
         logger.debug(f"Removing secret with label {event.secret.label} revision {event.revision}")
         event.remove_revision()
 
-    @property
+    @cached_property
     def version(self) -> str:
-        """Returns the version Pgbouncer."""
+        """Returns the version Pgbouncer.
+
+        Parsed once per hook, as config rendering and status checks ask for it repeatedly.
+        Refreshing the snap drops the cached value.
+        """
         try:
             # Input is hardcoded
             output = subprocess.check_output([PGBOUNCER_EXECUTABLE, "--version"])  # noqa: S603
@@ -344,6 +645,26 @@ class PgBouncerCharm(TypedCharmBase):
             logger.exception("Unable to get Pgbouncer version")
             return ""
 
+    def version_at_least(self, *min_version: int) -> bool:
+        """Returns whether the installed pgbouncer is at least the given version."""
+        try:
+            version = tuple(int(part) for part in (self.version or "").split("."))
+        except ValueError:
+            return False
+        return version >= min_version
+
+    @property
+    def max_prepared_statements(self) -> Optional[int]:
+        """Prepared statements tracked per connection, or None if pgbouncer doesn't support it.
+
+        Tracking is only needed when server connections are shared between clients.
+        """
+        if not self.version_at_least(1, 21):
+            return None
+        if self.config.pool_mode == "session":
+            return 0
+        return self.config.max_prepared_statements
+
     def _normalize_secret_key(self, key: str) -> str:
         new_key = key.replace("_", "-")
         new_key = new_key.strip("-")
@@ -478,11 +799,7 @@ class PgBouncerCharm(TypedCharmBase):
         # Done first to instantiate the snap's private tmp
         self.unit.set_workload_version(self.version)
 
-        if (
-            (auth_file := self.get_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY))
-            and self.backend.auth_user
-            and self.backend.auth_user in auth_file
-        ):
+        if self.backend.auth_user and self.backend.auth_user in self.get_userlist():
             self.render_auth_file()
             self.render_pgb_config()
 
@@ -493,34 +810,88 @@ class PgBouncerCharm(TypedCharmBase):
             for service in self.pgb_services:
                 logger.info(f"starting {service}")
                 systemd.service_start(service)
+            self.auto_prewarm_pools()
 
             self.update_status()
         except systemd.SystemdError as e:
             logger.error(e)
             self.unit.status = BlockedStatus("failed to start pgbouncer")
-        prom_service = f"{PGB}-{self.app.name}-prometheus"
-        if os.path.exists(f"/etc/systemd/system/{prom_service}.service"):
-            try:
-                systemd.service_start(prom_service)
-            except systemd.SystemdError as e:
-                logger.error(e)
-                self.unit.status = BlockedStatus("failed to start pgbouncer exporter")
+        try:
+            for group, service_ids in self.instance_groups.items():
+                if not os.path.exists(f"/etc/systemd/system/{PGB}-{group}-prometheus@.service"):
+                    continue
+                for service_id in service_ids:
+                    systemd.service_start(f"{PGB}-{group}-prometheus@{service_id}")
+        except systemd.SystemdError as e:
+            logger.error(e)
+            self.unit.status = BlockedStatus("failed to start pgbouncer exporter")
 
     def _on_leader_elected(self, _):
         self.peers.update_leader()
 
+    def _get_readonly_hosts(self) -> Tuple[List[str], Optional[str]]:
+        """Returns the hosts serving read-only traffic and their port.
+
+        When lag filtering is enabled, the replicas published by the leader are used in their
+        published order, falling back to the primary if every replica lags behind.
+        """
+        read_only_endpoints = self.backend.get_read_only_endpoints()
+        if not read_only_endpoints:
+            return [], None
+        r_port = next(iter(read_only_endpoints)).split(":")[1]
+
+        readonly_hosts = (self.peers.app_databag or {}).get(READONLY_HOSTS_KEY)
+        if not self.config.readonly_max_lag or readonly_hosts is None:
+            r_hosts = sorted(r_host.split(":")[0] for r_host in read_only_endpoints)
+            return self._weighted_hosts(r_hosts), r_port
+
+        if r_hosts := json.loads(readonly_hosts):
+            return self._weighted_hosts(r_hosts), r_port
+        if postgres_endpoint := self.backend.postgres_databag.get("endpoints"):
+            host, port = postgres_endpoint.split(":")
+            return [host], port
+        return [], None
+
+    def _get_readonly_weights(self) -> Dict[str, int]:
+        """Returns the weight of the replicas for the configured readonly routing."""
+        if self.config.readonly_routing == "weighted" and self.config.readonly_weights:
+            weights = parse_kv_string_to_dict(self.config.readonly_weights.strip())
+            return {host: int(weight) for host, weight in weights.items()}
+        if self.config.readonly_routing == "load" and self.peers.app_databag:
+            return json.loads(self.peers.app_databag.get(READONLY_WEIGHTS_KEY, "{}"))
+        return {}
+
+    def _weighted_hosts(self, hosts: List[str]) -> List[str]:
+        """Repeats each host as many times as its weight.
+
+        Hosts are interleaved, so that round robin over the list spreads connections smoothly.
+        """
+        weights = self._get_readonly_weights()
+        max_weight = max([weights.get(host, 1) for host in hosts], default=1)
+        return [
+            host for turn in range(max_weight) for host in hosts if weights.get(host, 1) > turn
+        ]
+
+    def _get_backend_host(self, host: str, port: str) -> str:
+        """Returns the backend unix socket directory if PostgreSQL runs on this machine.
+
+        Server connections to a co-located PostgreSQL go over its unix socket rather than TCP.
+        """
+        socket_dir = self.config.backend_socket_dir
+        if socket_dir and host == self.unit_ip and os.path.exists(f"{socket_dir}/.s.PGSQL.{port}"):
+            return socket_dir
+        return host
+
+    def _get_readonly_listener_dbs(self, databases: Dict) -> Dict[str, Dict[str, str]]:
+        """Returns the relation databases served by the readonly listener."""
+        return {name: db for name, db in databases.items() if name.endswith("_readonly")}
+
     def _get_readonly_dbs(self, databases: Dict) -> Dict[str, str]:
         readonly_dbs = {}
         if self.backend.relation and "*" in databases:
-            read_only_endpoints = self.backend.get_read_only_endpoints()
-            sorted_rhosts = [r_host.split(":")[0] for r_host in read_only_endpoints]
-            sorted_rhosts.sort()
-            r_hosts = ",".join(sorted_rhosts)
+            sorted_rhosts, r_port = self._get_readonly_hosts()
+            r_hosts = ",".join(self._get_backend_host(r_host, r_port) for r_host in sorted_rhosts)
             if r_hosts:
-                for r_host in read_only_endpoints:
-                    r_port = r_host.split(":")[1]
-                    break
-
                 backend_databases = json.loads(self.peers.app_databag.get("readonly_dbs", "[]"))
                 for name in backend_databases:
                     readonly_dbs[f"{name}_readonly"] = {
@@ -550,6 +921,88 @@ class PgBouncerCharm(TypedCharmBase):
             readonly_dbs.sort()
             self.peers.app_databag["readonly_dbs"] = json.dumps(readonly_dbs)
 
+    def _collect_readonly_hosts(self) -> None:
+        """Publishes the replicas within the lag threshold, ordered by replay lag."""
+        if not self.unit.is_leader() or not self.backend.postgres:
+            return
+
+        if not self.config.readonly_max_lag:
+            readonly_hosts = None
+        else:
+            try:
+                with self.backend.postgres._connect_to_database(
+                    PGB
+                ) as conn, conn.cursor() as cursor:
+                    # Replay lag is null once an idle replica has caught up
+                    cursor.execute(
+                        "SELECT client_addr, COALESCE(EXTRACT(EPOCH FROM replay_lag), 0) "
+                        "FROM pg_stat_replication WHERE state = 'streaming';"
+                    )
+                    results = cursor.fetchall()
+                conn.close()
+            except psycopg2.Error:
+                logger.warning("PostgreSQL connection failed")
+                return
+            lags = {str(host): float(lag) for host, lag in results if host}
+            r_hosts = [r_host.split(":")[0] for r_host in self.backend.get_read_only_endpoints()]
+            readonly_hosts = json.dumps(
+                sorted(
+                    (
+                        host
+                        for host in r_hosts
+                        if lags.get(host, math.inf) <= self.config.readonly_max_lag
+                    ),
+                    key=lambda host: (lags[host], host),
+                )
+            )
+
+        if readonly_hosts == self.peers.app_databag.get(READONLY_HOSTS_KEY):
+            return
+        if readonly_hosts is None:
+            del self.peers.app_databag[READONLY_HOSTS_KEY]
+        else:
+            self.peers.app_databag[READONLY_HOSTS_KEY] = readonly_hosts
+        # Followers re-render on peer relation changed
+        self.render_pgb_config()
+
+    def _collect_readonly_weights(self) -> None:
+        """Publishes replica weights inversely proportional to their connected backends."""
+        if not self.unit.is_leader() or not self.backend.postgres:
+            return
+
+        if self.config.readonly_routing != "load":
+            readonly_weights = None
+        else:
+            backends = {}
+            for r_host in self.backend.get_read_only_endpoints():
+                host = r_host.split(":")[0]
+                try:
+                    with self.backend.postgres._connect_to_database(
+                        PGB, database_host=host
+                    ) as conn, conn.cursor() as cursor:
+                        cursor.execute("SELECT SUM(numbackends) FROM pg_stat_database;")
+                        backends[host] = int(cursor.fetchone()[0] or 0)
+                    conn.close()
+                except psycopg2.Error:
+                    logger.warning(f"Unable to sample the load of replica {host}")
+            least_backends = min(backends.values(), default=0)
+            readonly_weights = json.dumps(
+                {
+                    host: max(round(READONLY_MAX_WEIGHT * (least_backends + 1) / (count + 1)), 1)
+                    for host, count in backends.items()
+                },
+                sort_keys=True,
+            )
+
+        if readonly_weights == self.peers.app_databag.get(READONLY_WEIGHTS_KEY):
+            return
+        if readonly_weights is None:
+            del self.peers.app_databag[READONLY_WEIGHTS_KEY]
+        else:
+            self.peers.app_databag[READONLY_WEIGHTS_KEY] = readonly_weights
+        # Followers re-render on peer relation changed
+        self.render_pgb_config()
+
     def _on_update_status(self, _) -> None:
         """Update Status hook.
 
@@ -565,6 +1018,14 @@ class PgBouncerCharm(TypedCharmBase):
         self.peers.update_leader()
         self._collect_readonly_dbs()
 
+        # The remaining steps read the config, an invalid one is only reported
+        if not self.configuration_check():
+            return
+        self._report_instance_skew()
+        self._publish_client_count()
+        self._collect_readonly_hosts()
+        self._collect_readonly_weights()
+
     def configuration_check(self) -> bool:
         """Check that configuration is valid."""
         try:
@@ -608,10 +1069,22 @@ class PgBouncerCharm(TypedCharmBase):
             return
 
         if self.check_pgb_running():
-            if self.unit.is_leader() and self.config.vip:
-                self.unit.status = ActiveStatus(f"VIP: {self.config.vip}")
+            self.unit.status = ActiveStatus(self._active_status_message())
+
+    def _active_status_message(self) -> str:
+        """Builds the active status message from the VIP and prepared statements state."""
+        messages = []
+        if self.unit.is_leader() and self.config.vip:
+            messages.append(f"VIP: {self.config.vip}")
+        if self.config.pool_mode != "session":
+            max_prepared_statements = self.max_prepared_statements
+            if max_prepared_statements is None:
+                messages.append("prepared statements unsupported")
+            elif max_prepared_statements:
+                messages.append("prepared statements enabled")
             else:
-                self.unit.status = ActiveStatus()
+                messages.append("prepared statements disabled")
+        return ", ".join(messages)
 
     def _on_config_changed(self, event) -> None:
         """Config changed handler.
@@ -627,32 +1100,43 @@ class PgBouncerCharm(TypedCharmBase):
         if not self.configuration_check():
             return
 
-        old_vip = self.peers.app_databag.get("current_vip", "")
         vip = self.config.vip if self.config.vip else ""
-        vip_changed = old_vip != vip
-        if vip_changed and self._is_exposed:
+        # Also republishes the health check settings, the relation data only changes with them
+        if self._is_exposed:
             self.hacluster.set_vip(self.config.vip)
 
-        old_port = self.peers.app_databag.get("current_port")
-        port_changed = old_port != str(self.config.listen_port)
+        old_ports = (
+            self.peers.app_databag.get("current_port"),
+            self.peers.app_databag.get("current_readonly_port", "0"),
+        )
+        ports = (str(self.config.listen_port), str(self.config.readonly_listen_port))
+        port_changed = old_ports != ports
         if port_changed and self._is_exposed:
             # Open port
             try:
-                self.unit.set_ports(self.config.listen_port)
+                self.unit.set_ports(*self.listen_ports)
             except ModelError:
                 logger.exception("failed to open port")
 
         if self.unit.is_leader():
-            self.peers.app_databag["current_port"] = str(self.config.listen_port)
+            self.peers.app_databag["current_port"] = ports[0]
+            self.peers.app_databag["current_readonly_port"] = ports[1]
             if vip:
                 self.peers.app_databag["current_vip"] = str(vip)
             else:
                 self.peers.app_databag.pop("current_vip", None)
 
+        # Affinity changes only apply on restart
+        affinity_changed = self.render_cpu_affinity()
+        log_sink_changed = self.render_log_sink()
+        self.update_instances()
+        self.render_logrotate()
+        self.peers.update_instances_count()
+
         # TODO hitting upgrade errors here due to secrets labels failing to set on non-leaders.
         # deferring until the leader manages to set the label
         try:
-            self.render_pgb_config(restart=port_changed)
+            self.render_pgb_config(restart=port_changed or affinity_changed or log_sink_changed)
         except ModelError:
             logger.warning("Deferring on_config_changed: cannot set secret label")
             event.defer()
@@ -666,11 +1150,10 @@ class PgBouncerCharm(TypedCharmBase):
 
     def check_pgb_running(self):
         """Checks that pgbouncer service is running, and updates status accordingly."""
-        prom_service = f"{PGB}-{self.app.name}-prometheus"
         services = [*self.pgb_services]
 
         if self.backend.ready:
-            services.append(prom_service)
+            services.extend(self.exporter_services)
 
         try:
             for service in services:
@@ -714,6 +1197,23 @@ class PgBouncerCharm(TypedCharmBase):
         """Updates the relation databases."""
         self.peers.app_databag["pgb_dbs_config"] = json.dumps(databases)
 
+    def get_userlist(self) -> UserList:
+        """Get the auth file entries."""
+        return UserList.parse(self.get_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY) or "")
+
+    def set_userlist(self, userlist: UserList) -> bool:
+        """Updates the auth file secret, if its entries changed.
+
+        Returns:
+            Whether the secret was updated.
+        """
+        added, removed, changed = self.get_userlist().diff(userlist)
+        if not (added or removed or changed):
+            return False
+        logger.debug(f"Auth file users added: {added}, removed: {removed}, changed: {changed}")
+        self.set_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY, str(userlist))
+        return True
+
     def get_relation_databases(self) -> Dict[str, Dict[str, Union[str, bool]]]:
         """Get relation databases."""
         if "pgb_dbs_config" in self.peers.app_databag:
@@ -806,16 +1306,11 @@ class PgBouncerCharm(TypedCharmBase):
         if not (postgres_endpoint := self.backend.postgres_databag.get("endpoints")):
             return {}
         host, port = postgres_endpoint.split(":")
+        host = self._get_backend_host(host, port)
 
-        read_only_endpoints = self.backend.get_read_only_endpoints()
-        sorted_rhosts = [r_host.split(":")[0] for r_host in read_only_endpoints]
-        sorted_rhosts.sort()
-        r_hosts = ",".join(sorted_rhosts)
-        if r_hosts:
-            for r_host in read_only_endpoints:
-                r_port = r_host.split(":")[1]
-                break
-        else:
+        sorted_rhosts, r_port = self._get_readonly_hosts()
+        r_hosts = ",".join(self._get_backend_host(r_host, r_port) for r_host in sorted_rhosts)
+        if not r_hosts:
             r_hosts = host
             r_port = port
 
@@ -846,6 +1341,565 @@ class PgBouncerCharm(TypedCharmBase):
             }
         return pgb_dbs
 
+    def _get_pool_budget(self, readonly: bool = False) -> Tuple[int, int]:
+        """Returns the server connections budget and instance count of an instance group."""
+        if readonly:
+            return self.config.readonly_max_db_connections, self.readonly_instances_count
+        return self.config.max_db_connections, self.instances_count
+
+    def _get_pool_sizes(self, readonly: bool = False) -> Tuple[int, int, int]:
+        """Returns the default, min and reserve pool sizes of each instance of a group."""
+        max_db_connections, instances_count = self._get_pool_budget(readonly)
+        if max_db_connections == 0:
+            return 20, 10, 10
+
+        effective_db_connections = max_db_connections / instances_count
+        return (
+            math.ceil(effective_db_connections / 2),
+            math.ceil(effective_db_connections / 4),
+            math.ceil(effective_db_connections / 4),
+        )
+
+    @staticmethod
+    def _get_available_memory() -> Optional[int]:
+        """Returns the memory available on the host in bytes, or None if it cannot be read."""
+        try:
+            with open("/proc/meminfo") as file:
+                for line in file:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            logger.exception("Unable to read the host memory")
+        return None
+
+    def get_connection_limits(
+        self, databases_count: int, readonly: bool = False
+    ) -> Dict[str, int]:
+        """Derives the client connection ceiling of each instance from the host resources.
+
+        Every client and server connection takes a file descriptor out of the unit file limit and
+        a packet buffer out of memory, so the ceiling is the lower of what is left of the
+        descriptors after the server connections and the instance share of the memory budget.
+        """
+        max_db_connections, instances_count = self._get_pool_budget(readonly)
+        default_pool_size, _, reserve_pool_size = self._get_pool_sizes(readonly)
+        # Each instance enforces max_db_connections on every database on its own
+        server_connections = (
+            max_db_connections or default_pool_size + reserve_pool_size
+        ) * databases_count
+        max_client_conn = PGB_FD_LIMIT - PGB_FD_RESERVE - server_connections
+
+        limits = {
+            "fd-limit": PGB_FD_LIMIT,
+            "instances": instances_count,
+            "server-connections": server_connections,
+        }
+        if available_memory := self._get_available_memory():
+            # The memory share is split evenly between the instances of all groups
+            total_instances = self.instances_count + self.readonly_instances_count
+            memory_budget = int(available_memory * PGB_MEMORY_SHARE / total_instances)
+            limits["memory-budget"] = memory_budget
+            max_client_conn = min(
+                max_client_conn,
+                # Each connection allocates a packet buffer for both the client and server side
+                memory_budget // (2 * self.config.tuning.pkt_buf) - server_connections,
+            )
+
+        limits["max-client-conn"] = max(max_client_conn, PGB_FD_RESERVE)
+        limits["total-max-client-conn"] = limits["max-client-conn"] * instances_count
+        return limits
+
+    def _on_get_connection_limits(self, event: ActionEvent) -> None:
+        """Reports the client connection ceiling of the unit."""
+        databases = self._get_relation_config()
+        readonly_dbs = self._get_readonly_dbs(databases)
+        results = self.get_connection_limits(len(databases) + len(readonly_dbs))
+        if self.readonly_service_ids:
+            results["readonly"] = self.get_connection_limits(
+                len(self._get_readonly_listener_dbs(databases)) + len(readonly_dbs), readonly=True
+            )
+        event.set_results(results)
+
+    def admin_console_query(
+        self, group: str, service_id: int, query: str, timeout: float = PGB_CONNECT_TIMEOUT
+    ) -> List[Dict]:
+        """Runs a command on the admin console of a pgbouncer instance.
+
+        The console is reached over the instance unix socket, so that the command targets that
+        exact instance rather than the one picked by so_reuseport. The connection is asynchronous
+        so that blocking commands, like PAUSE, can be given up on after the timeout.
+
+        Returns:
+            The result rows, as dicts keyed by column name.
+
+        Raises:
+            psycopg2.Error: if the console can't be reached, the command fails or times out.
+        """
+        deadline = time.monotonic() + timeout
+        # Asynchronous connections are in autocommit mode, as the admin console requires
+        connection = psycopg2.connect(
+            host=f"{PGB_RUN_DIR}/{group}/{INSTANCE_DIR}{service_id}",
+            port=self._get_listen_port(group),
+            dbname=PGB,
+            user=self.backend.admin_user,
+            password=self.get_secret(APP_SCOPE, ADMIN_PASSWORD_KEY),
+            async_=True,
+        )
+        try:
+            self._wait_for_connection(connection, deadline)
+            cursor = connection.cursor()
+            cursor.execute(query)
+            self._wait_for_connection(connection, deadline)
+            if cursor.description is None:
+                return []
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _wait_for_connection(connection, deadline: float) -> None:
+        """Waits for the pending operation of an asynchronous connection to complete.
+
+        Raises:
+            psycopg2.OperationalError: if the operation doesn't complete before the deadline.
+        """
+        while (state := connection.poll()) != psycopg2.extensions.POLL_OK:
+            if (remaining := deadline - time.monotonic()) <= 0:
+                raise psycopg2.OperationalError("Timed out waiting for pgbouncer")
+            if state == psycopg2.extensions.POLL_READ:
+                select.select([connection.fileno()], [], [], remaining)
+            else:
+                select.select([], [connection.fileno()], [], remaining)
+
+    def get_instance_version(self, group: str, service_id: int) -> Tuple[int, ...]:
+        """Returns the version of the running pgbouncer instance, which may predate the snap."""
+        rows = self.admin_console_query(group, service_id, "SHOW VERSION;")
+        try:
+            return tuple(int(part) for part in rows[0]["version"].split(" ")[-1].split("."))
+        except (IndexError, KeyError, ValueError):
+            return ()
+
+    @staticmethod
+    def _get_main_pid(service: str) -> int:
+        """Returns the PID of the main process of a systemd unit, 0 if it isn't running."""
+        try:
+            output = subprocess.check_output(  # noqa: S603
+                ["systemctl", "show", "--property=MainPID", "--value", service]  # noqa: S607
+            )
+            return int(output.decode().strip() or 0)
+        except (subprocess.CalledProcessError, ValueError):
+            return 0
+
+    def _wait_for_exit(self, service: str, pid: int, deadline: float) -> bool:
+        """Waits for the given main process of a systemd unit to exit."""
+        while self._get_main_pid(service) == pid:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(1)
+        return True
+
+    def drain_instance(
+        self,
+        group: str,
+        service_id: int,
+        timeout: float = PGB_DRAIN_TIMEOUT,
+        restart: bool = True,
+    ) -> bool:
+        """Lets an instance finish serving its clients, then restarts or stops it.
+
+        From pgbouncer 1.23 the instance stops listening at once and exits when its last client
+        disconnects, while the instances sharing its port take the new connections. Older
+        instances are paused instead, which only waits for the in-flight queries: their clients
+        are still disconnected by the restart.
+
+        Returns:
+            Whether the instance drained before the timeout.
+        """
+        service = f"{PGB}-{group}@{service_id}"
+        deadline = time.monotonic() + timeout
+        pid = self._get_main_pid(service)
+        drained = False
+        try:
+            if self.get_instance_version(group, service_id) >= (1, 23):
+                # The console connection may be dropped as the instance starts shutting down
+                with contextlib.suppress(psycopg2.Error):
+                    self.admin_console_query(group, service_id, "SHUTDOWN WAIT_FOR_CLIENTS;")
+                drained = self._wait_for_exit(service, pid, deadline)
+            else:
+                self.admin_console_query(group, service_id, "PAUSE;", timeout)
+                drained = True
+        except psycopg2.Error as e:
+            logger.warning(f"Unable to drain {service}: {e}")
+        if not drained:
+            logger.warning(f"{service} still had clients after {timeout}s")
+
+        try:
+            if restart:
+                systemd.service_restart(service)
+            else:
+                systemd.service_stop(service)
+        except systemd.SystemdError as e:
+            logger.error(e)
+        if restart:
+            self._wait_for_instance(group, service_id)
+        return drained
+
+    def _get_listen_port(self, group: str) -> int:
+        """Returns the port the instances of the given group listen on."""
+        if group == self.app.name:
+            return self.config.listen_port
+        return self.config.readonly_listen_port
+
+    def _get_client_credentials(self) -> Dict[str, Tuple[str, str]]:
+        """Returns a user and password able to log into each client database."""
+        credentials = {}
+        for rel_id, database in self.get_relation_databases().items():
+            if not rel_id.isdigit() or database["name"] in credentials:
+                continue
+            user = self.backend.client_user(rel_id, database)
+            if database.get("legacy"):
+                password = json.loads(self.peers.app_databag.get(user, "{}")).get("password")
+            else:
+                password = self.get_secret(APP_SCOPE, f"{user}_password")
+            if password:
+                credentials[database["name"]] = (user, password)
+        return credentials
+
+    def _wait_for_instance(self, group: str, service_id: int) -> bool:
+        """Waits for a freshly (re)started instance to accept connections."""
+        try:
+            for attempt in Retrying(
+                stop=stop_after_delay(PGB_CONNECT_TIMEOUT), wait=wait_fixed(1)
+            ):
+                with attempt:
+                    self.admin_console_query(group, service_id, "SHOW VERSION;")
+        except RetryError:
+            logger.warning(f"{group}@{service_id} is not accepting connections")
+            return False
+        return True
+
+    def _prewarm_instance(
+        self,
+        group: str,
+        service_id: int,
+        databases: Dict[str, Dict[str, str]],
+        credentials: Dict[str, Tuple[str, str]],
+        pool_size: int,
+        deadline: float,
+    ) -> Dict[str, int]:
+        """Opens up to pool_size server connections for each database on an instance.
+
+        Every client holds a transaction open, so that each of them is given its own server
+        connection. The connections go back to the pool idle once the clients are closed.
+        """
+        warmed = {"databases": 0, "server-connections": 0, "failed-databases": 0}
+        databases = {
+            name: database
+            for name, database in databases.items()
+            if database.get("dbname") in credentials
+        }
+        # Nothing to wait for the instance for
+        if not databases:
+            return warmed
+        if not self._wait_for_instance(group, service_id):
+            warmed["failed-databases"] = len(databases)
+            return warmed
+        for name, database in databases.items():
+            if time.monotonic() > deadline:
+                continue
+            user, password = credentials[database["dbname"]]
+            clients = []
+            try:
+                while len(clients) < pool_size and time.monotonic() < deadline:
+                    clients.append(
+                        psycopg2.connect(
+                            host=f"{PGB_RUN_DIR}/{group}/{INSTANCE_DIR}{service_id}",
+                            port=self._get_listen_port(group),
+                            dbname=name,
+                            user=user,
+                            password=password,
+                            connect_timeout=PGB_CONNECT_TIMEOUT,
+                        )
+                    )
+                    with clients[-1].cursor() as cursor:
+                        cursor.execute("SELECT 1;")
+                warmed["databases"] += 1
+            except psycopg2.Error:
+                logger.warning(f"Unable to prewarm {name} on {group}@{service_id}")
+                warmed["failed-databases"] += 1
+            finally:
+                for client in clients:
+                    client.close()
+            warmed["server-connections"] += len(clients)
+        return warmed
+
+    def prewarm_pools(self, timeout: int = PGB_PREWARM_TIMEOUT) -> Dict:
+        """Fills the client database pools of every instance up to min_pool_size.
+
+        PgBouncer only creates the pool of a user on its first login, so after a restart, an
+        upgrade or a failover the first clients wait for server connections to be opened and
+        authenticated. Logging in on each instance opens them ahead of the clients.
+
+        Databases of relations whose password the units don't know, those created before the
+        passwords were kept, can't be logged into and are reported as skipped.
+
+        Returns:
+            The warmup duration and what was warmed on each instance.
+        """
+        start = time.monotonic()
+        databases = self._get_relation_config()
+        credentials = self._get_client_credentials()
+        # The wildcard database has no name to log into
+        skipped = sorted({
+            database["dbname"]
+            for database in databases.values()
+            if "dbname" in database and database["dbname"] not in credentials
+        })
+        if skipped:
+            logger.warning(f"Unable to prewarm {', '.join(skipped)}: unknown client passwords")
+        instances = {}
+        for group, service_ids in self.instance_groups.items():
+            if not service_ids:
+                continue
+            readonly = group != self.app.name
+            _, min_pool_size, _ = self._get_pool_sizes(readonly)
+            group_databases = self._get_readonly_listener_dbs(databases) if readonly else databases
+            for service_id in service_ids:
+                instances[f"{group}-{service_id}"] = self._prewarm_instance(
+                    group,
+                    service_id,
+                    group_databases,
+                    credentials,
+                    min_pool_size,
+                    start + timeout,
+                )
+        duration = time.monotonic() - start
+        logger.info(f"Prewarmed pgbouncer pools in {duration:.2f}s")
+        return {
+            "duration": f"{duration:.2f}",
+            "timed-out": duration > timeout,
+            "skipped-databases": ",".join(skipped),
+            "instances": instances,
+        }
+
+    def auto_prewarm_pools(self) -> None:
+        """Prewarms the pools if enabled by the prewarm_pools option."""
+        try:
+            enabled = self.config.prewarm_pools
+        except ValueError:
+            return
+        if enabled:
+            self.prewarm_pools()
+
+    def _on_prewarm_pools(self, event: ActionEvent) -> None:
+        """Prewarms the pools of the unit and reports how long it took."""
+        if not self.check_pgb_running():
+            event.fail("PgBouncer is not running")
+            return
+        event.set_results(self.prewarm_pools(event.params["timeout"]))
+
+    @staticmethod
+    def _get_cpu_time(pid: int) -> float:
+        """Returns the CPU seconds used by a process so far, 0 if it is gone."""
+        try:
+            with open(f"/proc/{pid}/stat") as file:
+                # The command name may hold spaces, the fields following it don't
+                fields = file.read().rsplit(")", 1)[1].split()
+            # utime and stime, the 14th and 15th fields of the line
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, IndexError, ValueError):
+            return 0.0
+
+    def sample_instance_load(self) -> Dict[str, Dict[int, Dict[str, float]]]:
+        """Samples the clients and CPU use of the running instances, by group and service id.
+
+        The CPU use is in cores, averaged over a short interval. A single instance can't be
+        skewed against its group, so the interval is only waited for, and the CPU use only
+        sampled, when a group has several instances. It is reported as 0 otherwise.
+        """
+        pids = {
+            (group, service_id): self._get_main_pid(f"{PGB}-{group}@{service_id}")
+            for group, service_ids in self.instance_groups.items()
+            for service_id in service_ids
+        }
+        pids = {instance: pid for instance, pid in pids.items() if pid}
+        sampled_groups = {
+            group for group, service_ids in self.instance_groups.items() if len(service_ids) > 1
+        }
+        cpu_times = {
+            instance: self._get_cpu_time(pid)
+            for instance, pid in pids.items()
+            if instance[0] in sampled_groups
+        }
+        start = time.monotonic()
+        if cpu_times:
+            time.sleep(PGB_CPU_SAMPLE_INTERVAL)
+
+        load = {}
+        for group, service_id in pids:
+            cpu = 0.0
+            if (cpu_time := cpu_times.get((group, service_id))) is not None:
+                cpu = (self._get_cpu_time(pids[(group, service_id)]) - cpu_time) / (
+                    time.monotonic() - start
+                )
+            try:
+                clients = self._get_client_count(group, service_id)
+            except psycopg2.Error as e:
+                logger.warning(f"Unable to get the pools of {group}@{service_id}: {e}")
+                continue
+            load.setdefault(group, {})[service_id] = {"clients": clients, "cpu": max(cpu, 0.0)}
+        return load
+
+    def _get_client_count(self, group: str, service_id: int) -> int:
+        """Returns the number of clients connected to an instance, admin console aside."""
+        pools = self.admin_console_query(group, service_id, "SHOW POOLS;")
+        return sum(
+            pool["cl_active"] + pool["cl_waiting"] for pool in pools if pool["database"] != PGB
+        )
+
+    def _publish_client_count(self) -> None:
+        """Publishes the clients of the unit to the peers, for the leader to order endpoints by."""
+        if (
+            not isinstance(self.unit.status, ActiveStatus)
+            or self.config.endpoint_ordering != "load"
+        ):
+            return
+
+        clients = 0
+        for group, service_ids in self.instance_groups.items():
+            for service_id in service_ids:
+                try:
+                    clients += self._get_client_count(group, service_id)
+                except psycopg2.Error as e:
+                    logger.warning(f"Unable to get the pools of {group}@{service_id}: {e}")
+        self.peers.update_client_count(clients)
+
+    @staticmethod
+    def get_load_skew(load: Dict[int, Dict[str, float]]) -> float:
+        """Returns how much busier the busiest instance of a group is than the group average.
+
+        The clients and the CPU use are compared separately, and only once the busiest instance
+        is loaded enough for the spread to matter, otherwise the skew is 1.
+        """
+        skew = 1.0
+        for key, minimum in [
+            ("clients", INSTANCE_SKEW_MIN_CLIENTS),
+            ("cpu", INSTANCE_SKEW_MIN_CPU),
+        ]:
+            values = [instance[key] for instance in load.values()]
+            if len(values) > 1 and max(values) >= minimum:
+                skew = max(skew, max(values) * len(values) / sum(values))
+        return skew
+
+    def _report_instance_skew(self) -> None:
+        """Adds the worst load skew of the instance groups, if over the threshold, to the status."""
+        if not isinstance(self.unit.status, ActiveStatus) or not (
+            threshold := self.config.instance_skew_threshold
+        ):
+            return
+        if all(len(service_ids) < 2 for service_ids in self.instance_groups.values()):
+            return
+
+        skews = {
+            group: self.get_load_skew(load) for group, load in self.sample_instance_load().items()
+        }
+        if not skews or (skew := max(skews.values())) < threshold:
+            return
+        group = max(skews, key=skews.get)
+        logger.warning(f"The {group} instances are unevenly loaded, skew {skew:.1f}")
+        self.unit.status = ActiveStatus(
+            ", ".join(filter(None, [self.unit.status.message, f"{group} load skew {skew:.1f}x"]))
+        )
+
+    def _get_idle_clients(self, group: str, service_id: int) -> List[int]:
+        """Returns the ids of the clients of an instance that are outside of a transaction."""
+        clients = [
+            client
+            for client in self.admin_console_query(group, service_id, "SHOW CLIENTS;")
+            if client["database"] != PGB and client["state"] == "active"
+        ]
+        servers = {
+            server["ptr"]: (f"{server['addr']}:{server['port']}", server["remote_pid"])
+            for server in self.admin_console_query(group, service_id, "SHOW SERVERS;")
+        }
+        # Backend processes are looked up on their own host. Servers on hosts that aren't
+        # known endpoints, like local unix sockets, are never taken for idle.
+        endpoint_hosts = {
+            endpoint: endpoint.split(":")[0] for endpoint in self.backend.get_read_only_endpoints()
+        }
+        if primary := self.backend.postgres_databag.get("endpoints"):
+            endpoint_hosts[primary] = None
+        # Session pooling keeps idle clients linked to their server connection
+        linked_pids = {}
+        for client in clients:
+            if (server := servers.get(client["link"])) and server[0] in endpoint_hosts:
+                linked_pids.setdefault(server[0], []).append(server[1])
+        idle_servers = {
+            (endpoint, pid)
+            for endpoint, pids in linked_pids.items()
+            for pid in self.backend.get_idle_backend_pids(pids, endpoint_hosts[endpoint])
+        }
+        return [
+            client["id"]
+            for client in clients
+            if not client["link"] or servers.get(client["link"]) in idle_servers
+        ]
+
+    def _close_idle_clients(self, group: str, service_id: int, count: int) -> int:
+        """Closes up to the given number of idle clients of an instance.
+
+        Returns:
+            The number of clients closed.
+        """
+        closed = 0
+        for client_id in self._get_idle_clients(group, service_id)[:count]:
+            try:
+                self.admin_console_query(group, service_id, f"KILL_CLIENT {client_id};")
+                closed += 1
+            except psycopg2.Error as e:
+                logger.warning(f"Unable to close client {client_id} of {group}@{service_id}: {e}")
+        return closed
+
+    def rebalance_instances(self) -> Dict[str, Dict[str, int]]:
+        """Closes the idle clients of the instances holding more than their share of their group.
+
+        The closed clients reconnect through the shared port, which the kernel hashes over all
+        the instances of the group again.
+
+        Returns:
+            The clients of each instance before the rebalance, and how many were closed.
+        """
+        results = {}
+        for group, load in self.sample_instance_load().items():
+            share = math.ceil(sum(instance["clients"] for instance in load.values()) / len(load))
+            for service_id, instance in load.items():
+                closed = 0
+                if len(load) > 1 and (excess := instance["clients"] - share) > 0:
+                    closed = self._close_idle_clients(group, service_id, excess)
+                results[f"{group}-{service_id}"] = {
+                    "clients": instance["clients"],
+                    "closed": closed,
+                }
+        return results
+
+    def _on_rebalance_instances(self, event: ActionEvent) -> None:
+        """Evens out the clients of the instances of the unit and reports what was done."""
+        if not self.check_pgb_running():
+            event.fail("PgBouncer is not running")
+            return
+        if not self.backend.ready:
+            event.fail("Backend database relation not ready")
+            return
+        if not self.version_at_least(1, 24):
+            event.fail("Closing clients requires pgbouncer 1.24 or later")
+            return
+        try:
+            event.set_results({"instances": self.rebalance_instances()})
+        except psycopg2.Error as e:
+            logger.error(e)
+            event.fail("Unable to rebalance the instances")
+
     def render_pgb_config(self, restart=False) -> None:
         """Derives config files for the number of required services from given config.
 
@@ -862,7 +1916,8 @@ class PgBouncerCharm(TypedCharmBase):
         if self._is_exposed:
             # Open port
             try:
-                self.unit.open_port("tcp", self.config.listen_port)
+                for port in self.listen_ports:
+                    self.unit.open_port("tcp", port)
             except ModelError:
                 logger.exception("failed to open port")
 
@@ -872,91 +1927,182 @@ class PgBouncerCharm(TypedCharmBase):
         # Render primary config. This config is the only copy that the charm reads from to create
         # PgbConfig objects, and is modified below to implement individual services.
         app_conf_dir = f"{PGB_CONF_DIR}/{self.app.name}"
-        app_log_dir = f"{PGB_LOG_DIR}/{self.app.name}"
-        app_run_dir = f"{PGB_RUN_DIR}/{self.app.name}"
-        # Expected tmp location
-        app_temp_dir = f"/tmp/{self.app.name}"  # noqa: S108
-
-        userlist = self.get_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY)
-        if not userlist:
-            userlist = ""
-        auth_type = "md5" if f'"{self.backend.stats_user}" "md5' in userlist else "scram-sha-256"
-
-        if self.config.max_db_connections == 0:
-            default_pool_size = 20
-            min_pool_size = 10
-            reserve_pool_size = 10
-        else:
-            effective_db_connections = self.config.max_db_connections / self.instances_count
-            default_pool_size = math.ceil(effective_db_connections / 2)
-            min_pool_size = math.ceil(effective_db_connections / 4)
-            reserve_pool_size = math.ceil(effective_db_connections / 4)
+
+        stats_password = self.get_userlist().get(self.backend.stats_user) or ""
+        auth_type = "md5" if stats_password.startswith("md5") else "scram-sha-256"
+
         with open("templates/pgb_config.j2") as file:
             template = Template(file.read())
             databases = self._get_relation_config()
             readonly_dbs = self._get_readonly_dbs(databases)
+            max_prepared_statements = self.max_prepared_statements
+            # Spreads new server connections over the (weighted) host lists
+            load_balance_hosts = "round-robin" if self.version_at_least(1, 24) else None
             enable_tls = all(self.tls.get_tls_files()) and self._is_exposed
             addr = "*" if self._is_exposed else "127.0.0.1"
-            # Modify & render config files for each service instance
-            for service_id in self.service_ids:
-                self.unit.status = MaintenanceStatus("updating PgBouncer config")
-                try:
-                    self.render_file(
-                        f"{app_conf_dir}/{INSTANCE_DIR}{service_id}/pgbouncer.ini",
-                        template.render(
-                            databases=databases,
-                            readonly_databases=readonly_dbs,
-                            peer_id=service_id,
-                            base_socket_dir=f"{app_run_dir}/{INSTANCE_DIR}",
-                            peers=self.service_ids,
-                            log_file=f"{app_log_dir}/{INSTANCE_DIR}{service_id}/pgbouncer.log",
-                            pid_file=f"{app_temp_dir}/{INSTANCE_DIR}{service_id}/pgbouncer.pid",
-                            listen_addr=addr,
-                            listen_port=self.config.listen_port,
-                            pool_mode=self.config.pool_mode,
-                            max_db_connections=self.config.max_db_connections,
-                            default_pool_size=default_pool_size,
-                            min_pool_size=min_pool_size,
-                            reserve_pool_size=reserve_pool_size,
-                            admin_user=self.backend.admin_user,
-                            stats_user=self.backend.stats_user,
-                            auth_type=auth_type,
-                            auth_query=self.backend.auth_query,
-                            auth_file=self.conf_auth_file,
-                            enable_tls=enable_tls,
-                            key_file=f"{app_conf_dir}/{TLS_KEY_FILE}",
-                            ca_file=f"{app_conf_dir}/{TLS_CA_FILE}",
-                            cert_file=f"{app_conf_dir}/{TLS_CERT_FILE}",
-                        ),
-                        0o700,
-                    )
-                except FileNotFoundError:
-                    logger.warning(f"Service {service_id} not yet rendered")
+            log_sink = self.config.log_sink
+            groups = [(self.app.name, self.service_ids, self.config.listen_port, databases)]
+            if self.readonly_service_ids:
+                groups.append((
+                    f"{self.app.name}{READONLY_GROUP_SUFFIX}",
+                    self.readonly_service_ids,
+                    self.config.readonly_listen_port,
+                    self._get_readonly_listener_dbs(databases),
+                ))
+            for group, service_ids, listen_port, group_databases in groups:
+                readonly = group != self.app.name
+                group_conf_dir = f"{PGB_CONF_DIR}/{group}"
+                group_log_dir = f"{PGB_LOG_DIR}/{group}"
+                group_run_dir = f"{PGB_RUN_DIR}/{group}"
+                # Expected tmp location
+                group_temp_dir = f"/tmp/{group}"  # noqa: S108
+                max_db_connections, _ = self._get_pool_budget(readonly)
+                default_pool_size, min_pool_size, reserve_pool_size = self._get_pool_sizes(
+                    readonly
+                )
+                max_client_conn = self.get_connection_limits(
+                    len(group_databases) + len(readonly_dbs), readonly
+                )["max-client-conn"]
+                # Modify & render config files for each service instance
+                for service_id in service_ids:
+                    self.unit.status = MaintenanceStatus("updating PgBouncer config")
+                    try:
+                        self.render_file(
+                            f"{group_conf_dir}/{INSTANCE_DIR}{service_id}/pgbouncer.ini",
+                            template.render(
+                                databases=group_databases,
+                                readonly_databases=readonly_dbs,
+                                peer_id=service_id,
+                                base_socket_dir=f"{group_run_dir}/{INSTANCE_DIR}",
+                                peers=service_ids,
+                                log_file=(
+                                    f"{group_log_dir}/{INSTANCE_DIR}{service_id}/pgbouncer.log"
+                                    if log_sink == "file"
+                                    else None
+                                ),
+                                syslog_ident=(
+                                    f"{PGB}-{group}-{service_id}" if log_sink == "syslog" else None
+                                ),
+                                pid_file=f"{group_temp_dir}/{INSTANCE_DIR}{service_id}/pgbouncer.pid",
+                                listen_addr=addr,
+                                listen_port=listen_port,
+                                pool_mode=self.config.pool_mode,
+                                max_db_connections=max_db_connections,
+                                max_client_conn=max_client_conn,
+                                max_prepared_statements=max_prepared_statements,
+                                load_balance_hosts=load_balance_hosts,
+                                default_pool_size=default_pool_size,
+                                min_pool_size=min_pool_size,
+                                reserve_pool_size=reserve_pool_size,
+                                tuning=self.config.tuning.dict(),
+                                logging=self.config.logging,
+                                admin_user=self.backend.admin_user,
+                                stats_user=self.backend.stats_user,
+                                auth_type=auth_type,
+                                auth_query=self.backend.auth_query,
+                                auth_file=self.conf_auth_file,
+                                enable_tls=enable_tls,
+                                key_file=f"{app_conf_dir}/{TLS_KEY_FILE}",
+                                ca_file=f"{app_conf_dir}/{TLS_CA_FILE}",
+                                cert_file=f"{app_conf_dir}/{TLS_CERT_FILE}",
+                            ),
+                            0o700,
+                        )
+                    except FileNotFoundError:
+                        logger.warning(f"Service {group}@{service_id} not yet rendered")
         self.unit.status = initial_status
 
         self._reload_pgbouncer(restart)
 
+    def _get_metrics_port(self, group: str, service_id: int) -> int:
+        """Returns the port the exporter of the given instance serves metrics on.
+
+        The exporters of the readonly instances follow those of the main group.
+        """
+        if group == self.app.name:
+            return self.config.metrics_port + service_id
+        return self.config.metrics_port + len(self.service_ids) + service_id
+
+    @property
+    def _log_slots(self) -> List[str]:
+        """Snap slots COS scrapes the logs from, none when relying on the exporter alone.
+
+        Logs sent to syslog or the journal are left to the host log shipping.
+        """
+        try:
+            if self.config.log_mode == "quiet" or self.config.log_sink != "file":
+                return []
+        except ValueError:
+            logger.warning("Unable to set the log slots, invalid config")
+        return [f"{PGBOUNCER_SNAP_NAME}:logs"]
+
+    def _metrics_scrape_configs(self) -> List[Dict]:
+        """Scrape jobs of the exporters, labelled with the pgbouncer instance they report on."""
+        try:
+            static_configs = [
+                {
+                    "targets": [f"localhost:{self._get_metrics_port(group, service_id)}"],
+                    "labels": {"pgbouncer_instance": f"{group}-{service_id}"},
+                }
+                for group, service_ids in self.instance_groups.items()
+                for service_id in service_ids
+            ]
+        except ValueError:
+            logger.warning("Unable to set the scrape jobs, invalid config")
+            return []
+        return [{"job_name": PGB, "metrics_path": "/metrics", "static_configs": static_configs}]
+
     def render_prometheus_service(self):
-        """Render a unit file for the prometheus exporter and restarts the service."""
-        # Render prometheus exporter service file
+        """Render the unit files for the prometheus exporters and (re)starts the services.
+
+        Each pgbouncer instance gets its own exporter, connected over the instance unix socket,
+        since a TCP connection would land on whichever instance so_reuseport picks. The
+        credentials live in an environment file readable only by its owner, and the exporters
+        are only restarted when it or their unit changes, so that relation churn doesn't leave
+        gaps in the scraped series.
+        """
+        # Render prometheus exporter service files
         with open("templates/prometheus-exporter.service.j2") as file:
             template = Template(file.read())
-        # Render the template file with the correct values.
-        rendered = template.render(
-            stats_user=self.backend.stats_user,
-            pgb_service=f"{PGB}-{self.app.name}",
-            stats_password=self.get_secret(APP_SCOPE, MONITORING_PASSWORD_KEY),
-            listen_port=self.config.listen_port,
-            metrics_port=self.config.metrics_port,
-        )
-
-        service = f"{PGB}-{self.app.name}-prometheus"
-        self.render_file(f"/etc/systemd/system/{service}.service", rendered, perms=0o644)
+        stats_password = self.get_secret(APP_SCOPE, MONITORING_PASSWORD_KEY)
+        changed_groups = []
+        for group, service_ids in self.instance_groups.items():
+            unit_file = f"/etc/systemd/system/{PGB}-{group}-prometheus@.service"
+            env_file = f"{PGB_CONF_DIR}/{group}/prometheus-exporter.env"
+            if not service_ids:
+                self.delete_file(unit_file)
+                self.delete_file(env_file)
+                continue
+            # Render the template file with the correct values.
+            rendered = template.render(
+                env_file=env_file,
+                pgb_service=f"{PGB}-{group}",
+                socket_dir=f"{PGB_RUN_DIR}/{group}/{INSTANCE_DIR}",
+                metrics_port=self._get_metrics_port(group, 0),
+            )
+            dsn = (
+                f"postgresql://{self.backend.stats_user}:{stats_password}@/{PGB}"
+                f"?port={self._get_listen_port(group)}&sslmode=disable"
+            )
+            unit_changed = self.render_file_if_changed(unit_file, rendered, perms=0o644)
+            env_changed = self.render_file_if_changed(
+                env_file, f'EXPORTER_DSN="{dsn}"\n', perms=0o600
+            )
+            if unit_changed or env_changed:
+                changed_groups.append(group)
 
-        systemd.daemon_reload()
+        if changed_groups:
+            systemd.daemon_reload()
 
         try:
-            systemd.service_restart(service)
+            for group, service_ids in self.instance_groups.items():
+                for service_id in service_ids:
+                    service = f"{PGB}-{group}-prometheus@{service_id}"
+                    if group in changed_groups:
+                        systemd.service_restart(service)
+                    else:
+                        # Starts the exporters of new instances, running ones are left alone
+                        systemd.service_start(service)
         except systemd.SystemdError as e:
             logger.error(e)
             self.unit.status = BlockedStatus("Failed to restart prometheus exporter")
@@ -965,10 +2111,17 @@ class PgBouncerCharm(TypedCharmBase):
         """Renders the given auth_file to the correct location."""
         if not self.peers.unit_databag.get("userlist_nonce"):
             self.peers.unit_databag["userlist_nonce"] = generate_password()
-        if auth_file := self.get_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY):
+        if not (userlist := self.get_userlist()):
+            return
+        try:
+            with open(self.auth_file) as file:
+                rendered = UserList.parse(file.read())
+        except (OSError, ValueError):
+            rendered = None
+        if userlist != rendered:
             self.delete_file(self.auth_file)
-            self.render_file(self.auth_file, auth_file, perms=0o400)
-            self.peers.unit_databag["auth_file_set"] = "true"
+            self.render_file(self.auth_file, str(userlist), perms=0o400)
+        self.peers.unit_databag["auth_file_set"] = "true"
 
     # =================
     #  Charm Utilities
@@ -1007,6 +2160,8 @@ class PgBouncerCharm(TypedCharmBase):
                     "An exception occurred when installing %s. Reason: %s", snap_name, str(e)
                 )
                 raise
+            finally:
+                self.__dict__.pop("version", None)
 
     def render_file(self, path: str, content: str, perms: int) -> None:
         """Write content rendered from a template to a file.
@@ -1025,6 +2180,19 @@ class PgBouncerCharm(TypedCharmBase):
         # Set the correct ownership for the file.
         os.chown(path, uid=u.pw_uid, gid=u.pw_gid)
 
+    def render_file_if_changed(self, path: str, content: str, perms: int) -> bool:
+        """Write content to a file, unless the file already holds it.
+
+        Returns:
+            Whether the file was written.
+        """
+        if os.path.exists(path):
+            with open(path) as file:
+                if file.read() == content:
+                    return False
+        self.render_file(path, content, perms)
+        return True
+
     def delete_file(self, path: str):
         """Deletes file at the given path."""
         if os.path.exists(path):
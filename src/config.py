@@ -5,14 +5,84 @@
 """Structured configuration for the PostgreSQL charm."""
 
 import logging
-from typing import Literal, Optional
+import os
+from typing import Dict, Literal, Optional, Union
 
 from charms.data_platform_libs.v0.data_models import BaseConfigModel
-from pydantic import IPvAnyAddress, PositiveInt, conint
+from charms.pgbouncer_k8s.v0.pgb import parse_kv_string_to_dict
+from pydantic import (
+    BaseModel,
+    Extra,
+    IPvAnyAddress,
+    PositiveInt,
+    confloat,
+    conint,
+    constr,
+    validator,
+)
+
+from constants import READONLY_MAX_WEIGHT
 
 logger = logging.getLogger(__name__)
 
 
+class TuningProfile(BaseModel):
+    """Performance settings rendered into the pgbouncer section, defaulting to upstream values."""
+
+    server_idle_timeout: conint(ge=0) = 600
+    server_lifetime: conint(ge=0) = 3600
+    query_wait_timeout: conint(ge=0) = 120
+    idle_transaction_timeout: conint(ge=0) = 0
+    pkt_buf: conint(ge=4096) = 4096
+    sbuf_loopcnt: conint(ge=0) = 5
+    tcp_keepalive: conint(ge=0, le=1) = 1
+    server_check_delay: conint(ge=0) = 30
+    listen_backlog: PositiveInt = 128
+
+    class Config:
+        """Reject unknown settings."""
+
+        extra = Extra.forbid
+
+
+TUNING_PROFILES: Dict[str, Dict[str, int]] = {
+    "default": {},
+    # Short queries from a steady set of clients: fail fast rather than queue
+    "oltp": {
+        "server_idle_timeout": 300,
+        "query_wait_timeout": 15,
+        "idle_transaction_timeout": 60,
+        "server_check_delay": 10,
+        "listen_backlog": 1024,
+    },
+    # Long running queries returning large result sets
+    "analytics": {
+        "server_idle_timeout": 1800,
+        "server_lifetime": 7200,
+        "query_wait_timeout": 600,
+        "pkt_buf": 16384,
+        "sbuf_loopcnt": 20,
+        "server_check_delay": 60,
+    },
+    # Jobs that would rather wait for a server connection than fail
+    "batch": {
+        "server_idle_timeout": 3600,
+        "server_lifetime": 14400,
+        "query_wait_timeout": 0,
+        "pkt_buf": 8192,
+        "sbuf_loopcnt": 10,
+        "server_check_delay": 60,
+    },
+    # Large numbers of mostly idle clients connecting in bursts
+    "many-small-clients": {
+        "server_idle_timeout": 120,
+        "query_wait_timeout": 30,
+        "idle_transaction_timeout": 30,
+        "listen_backlog": 4096,
+    },
+}
+
+
 class CharmConfig(BaseConfigModel):
     """Manager for the structured configuration."""
 
@@ -22,3 +92,117 @@ class CharmConfig(BaseConfigModel):
     local_connection_type: Literal["tcp", "uds"]
     pool_mode: Literal["session", "transaction", "statement"]
     max_db_connections: conint(ge=0)
+    max_prepared_statements: conint(ge=0)
+    readonly_max_lag: conint(ge=0)
+    readonly_routing: Literal["round-robin", "weighted", "load"]
+    readonly_weights: Optional[str]
+    readonly_instances_count: PositiveInt
+    readonly_max_db_connections: conint(ge=0)
+    backend_socket_dir: Optional[str]
+    instances_count: Union[Literal["auto"], PositiveInt]
+    # Declared after the settings it is checked against
+    readonly_listen_port: conint(ge=0)
+    cpu_affinity: bool
+    tuning_profile: Literal["default", "oltp", "analytics", "batch", "many-small-clients"]
+    tuning_overrides: Optional[str]
+    prewarm_pools: bool
+    upgrade_strategy: Literal["stop-start", "rolling"]
+    upgrade_drain_timeout: conint(ge=0)
+    instance_skew_threshold: confloat(ge=0)
+    log_max_size: constr(regex=r"^[1-9][0-9]*[kMG]?$")
+    log_retention: PositiveInt
+    log_mode: Literal["normal", "quiet"]
+    log_sink: Literal["file", "syslog", "journald"]
+    ha_monitor_interval: PositiveInt
+    ha_failure_timeout: PositiveInt
+    endpoint_ordering: Literal["leader-first", "rotate", "load"]
+    log_connections: bool
+    log_disconnections: bool
+    log_pooler_errors: bool
+    stats_period: PositiveInt
+
+    @validator("instances_count")
+    @classmethod
+    def instances_count_values(cls, value: Union[str, int]) -> Union[str, int]:
+        """Check that an explicit instance count doesn't exceed the host CPU cores."""
+        if value != "auto" and value > os.cpu_count():
+            raise ValueError(f"Value exceeds the {os.cpu_count()} available CPU cores")
+        return value
+
+    @validator("readonly_listen_port")
+    @classmethod
+    def readonly_listen_port_values(cls, value: int, values: Dict) -> int:
+        """Check that the readonly port is not taken by the main listener or the exporters."""
+        if not value:
+            return value
+        if value == values.get("listen_port"):
+            raise ValueError("Value must differ from listen_port")
+        if (metrics_port := values.get("metrics_port")) is None:
+            return value
+        instances_count = values.get("instances_count")
+        if instances_count == "auto":
+            # Upper bound of the automatic instance count
+            instances_count = max(min(os.cpu_count(), 4), 2)
+        elif instances_count is None:
+            return value
+        exporters_count = instances_count + values.get("readonly_instances_count", 1)
+        if metrics_port <= value < metrics_port + exporters_count:
+            raise ValueError(
+                f"Value must be outside of the exporter ports {metrics_port}-"
+                f"{metrics_port + exporters_count - 1}"
+            )
+        return value
+
+    @validator("tuning_overrides")
+    @classmethod
+    def tuning_overrides_values(cls, value: Optional[str]) -> Optional[str]:
+        """Check that the overrides are known settings with valid values."""
+        if value:
+            try:
+                overrides = parse_kv_string_to_dict(value.strip())
+            except ValueError as e:
+                raise ValueError("Overrides must be space separated key=value pairs") from e
+            TuningProfile(**overrides)
+        return value
+
+    @validator("readonly_weights")
+    @classmethod
+    def readonly_weights_values(cls, value: Optional[str]) -> Optional[str]:
+        """Check that the replica weights are integers within the supported range."""
+        if value:
+            try:
+                weights = parse_kv_string_to_dict(value.strip())
+                valid = all(1 <= int(weight) <= READONLY_MAX_WEIGHT for weight in weights.values())
+            except ValueError as e:
+                raise ValueError("Weights must be space separated host=weight pairs") from e
+            if not valid:
+                raise ValueError(f"Weights must be between 1 and {READONLY_MAX_WEIGHT}")
+        return value
+
+    @validator("backend_socket_dir")
+    @classmethod
+    def backend_socket_dir_values(cls, value: Optional[str]) -> Optional[str]:
+        """Check that the socket directory is an absolute path."""
+        if value and not value.startswith("/"):
+            raise ValueError("Value must be an absolute path")
+        return value
+
+    @property
+    def tuning(self) -> TuningProfile:
+        """Settings of the tuning profile with the overrides applied."""
+        settings = dict(TUNING_PROFILES[self.tuning_profile])
+        if self.tuning_overrides:
+            settings.update(parse_kv_string_to_dict(self.tuning_overrides.strip()))
+        return TuningProfile(**settings)
+
+    @property
+    def logging(self) -> Dict[str, int]:
+        """Pgbouncer logging settings, all off in quiet mode but the stats period."""
+        quiet = self.log_mode == "quiet"
+        return {
+            "log_connections": int(self.log_connections and not quiet),
+            "log_disconnections": int(self.log_disconnections and not quiet),
+            "log_pooler_errors": int(self.log_pooler_errors and not quiet),
+            "log_stats": int(not quiet),
+            "stats_period": self.stats_period,
+        }
@@ -29,6 +29,8 @@ SNAP_CURRENT_PATH = f"/var/snap/{PGBOUNCER_SNAP_NAME}/current"
 PGB_CONF_DIR = f"{SNAP_CURRENT_PATH}/etc/pgbouncer"
 PGB_RUN_DIR = f"{SNAP_CURRENT_PATH}/run/pgbouncer"
 PGB_LOG_DIR = f"{SNAP_COMMON_PATH}/var/log/pgbouncer"
+# Instance group of the dedicated readonly listener, pgbouncer-<app>-ro@<N>
+READONLY_GROUP_SUFFIX = "-ro"
 
 # Expected tmp location
 SNAP_TMP_DIR = f"/tmp/snap-private-tmp/snap.{PGBOUNCER_SNAP_NAME}/tmp"  # noqa: S108
@@ -38,6 +40,31 @@ SNAP_SHM_DIR = f"/dev/shm/snap.{PGBOUNCER_SNAP_NAME}"  # noqa: S108
 # PGB config
 DATABASES = "databases"
 
+# Resource limits
+# File descriptor limit set in the pgbouncer unit file
+PGB_FD_LIMIT = 65536
+# Descriptors kept aside for the listen, peer and log files of an instance
+PGB_FD_RESERVE = 100
+# Share of the available host memory given to client connections, the rest is left to the principal
+PGB_MEMORY_SHARE = 0.25
+
+# Seconds to wait for a connection to a local pgbouncer instance
+PGB_CONNECT_TIMEOUT = 5
+# Seconds a pool prewarm may take before giving up on the remaining pools
+PGB_PREWARM_TIMEOUT = 30
+# Seconds the instances may take, all together, to let their clients go before being restarted
+PGB_DRAIN_TIMEOUT = 300
+# Minutes between checks of the log sizes against the rotation threshold
+LOGROTATE_INTERVAL = 15
+# Seconds over which the CPU use of the instances is sampled
+PGB_CPU_SAMPLE_INTERVAL = 1
+# Least clients on the busiest instance, or CPU cores it uses, for a load skew to be reported
+INSTANCE_SKEW_MIN_CLIENTS = 10
+INSTANCE_SKEW_MIN_CPU = 0.1
+# Least change of a unit client count, absolute and relative, worth publishing to the peers
+CLIENT_COUNT_MIN_CHANGE = 10
+CLIENT_COUNT_MIN_RATIO = 0.2
+
 # relation data
 DB_RELATION_NAME = "db"
 DB_ADMIN_RELATION_NAME = "db-admin"
@@ -45,12 +72,18 @@ BACKEND_RELATION_NAME = "backend-database"
 PEER_RELATION_NAME = "pgb-peers"
 CLIENT_RELATION_NAME = "database"
 HACLUSTER_RELATION_NAME = "ha"
+# OCF agent colocated with the VIP, run by pacemaker as ocf:pgbouncer:health
+HA_HEALTH_AGENT = "/usr/lib/ocf/resource.d/pgbouncer/health"
 
 TLS_KEY_FILE = "key.pem"
 TLS_CA_FILE = "ca.pem"
 TLS_CERT_FILE = "cert.pem"
 
 CFG_FILE_DATABAG_KEY = "cfg_file"
+READONLY_HOSTS_KEY = "readonly_hosts"
+READONLY_WEIGHTS_KEY = "readonly_weights"
+# Highest weight of a replica, i.e. the most times it can be repeated in a readonly host list
+READONLY_MAX_WEIGHT = 10
 AUTH_FILE_DATABAG_KEY = "auth_file"
 
 EXTENSIONS_BLOCKING_MESSAGE = "bad relation request - remote app requested extensions, which are unsupported. Please remove this relation."
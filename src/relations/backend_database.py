@@ -55,7 +55,12 @@ from charms.data_platform_libs.v0.data_interfaces import (
     DatabaseCreatedEvent,
     DatabaseRequires,
 )
-from charms.pgbouncer_k8s.v0.pgb import generate_password, get_md5_password, get_scram_password
+from charms.pgbouncer_k8s.v0.pgb import (
+    UserList,
+    generate_password,
+    get_md5_password,
+    get_scram_password,
+)
 from charms.postgresql_k8s.v0.postgresql import PostgreSQL as PostgreSQLv0
 from ops.charm import CharmBase, RelationBrokenEvent, RelationDepartedEvent
 from ops.framework import Object
@@ -161,27 +166,96 @@ class BackendDatabaseRequires(Object):
 
         return databases
 
-    def generate_scram_hash(self, user: str, password: str) -> str:
-        """Generate SCRAM hash against the current backend."""
-        conn = None
-        try:
-            with self.postgres._connect_to_database() as conn:
-                return get_scram_password(user, password, conn)
-        finally:
-            if conn:
-                conn.close()
-
-    def generate_system_user(self, user: str, password_key: str) -> Optional[str]:
+    def generate_system_user(self, user: str, password_key: str) -> str:
         """Generate credentials for an internal PGB user and return the SCRAM password."""
         if not (password := self.charm.get_secret(APP_SCOPE, password_key)):
             password = generate_password()
+        self.charm.set_secret(APP_SCOPE, password_key, password)
+        return get_scram_password(user, password)
+
+    def client_user(self, rel_id: str, database: Dict[str, Union[str, bool]]) -> str:
+        """User created by the charm for the given client relation database."""
+        if database.get("legacy"):
+            # Both legacy relations name their users the same way
+            return self.charm.legacy_db_relation._generate_username(rel_id)
+        return f"relation_id_{rel_id}"
+
+    @property
+    def client_users(self) -> List[str]:
+        """Users created by the charm for its client relations."""
+        return [
+            self.client_user(rel_id, database)
+            for rel_id, database in self.charm.get_relation_databases().items()
+            if rel_id.isdigit()
+        ]
+
+    def sync_auth_file_users(self) -> None:
+        """Copy the SCRAM verifiers of the client users into the auth file.
+
+        PgBouncer looks users up in the auth file before falling back to auth_query, so listing
+        the relation users there saves a query to the primary on every new client login. The
+        verifiers are read from the backend, so SCRAM pass-through to the server keeps working.
+        """
+        if not self.charm.unit.is_leader() or not (userlist := self.charm.get_userlist()):
+            return
+
+        system_users = {self.auth_user, self.stats_user, self.admin_user}
+        for user in [user for user in userlist if user not in system_users]:
+            userlist.remove(user)
         try:
-            hashed_password = self.generate_scram_hash(user, password)
+            with self.postgres._connect_to_database() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT rolname, rolpassword FROM pg_authid WHERE rolname = ANY(%s) "
+                    "AND rolpassword LIKE 'SCRAM-SHA-256$%%' ORDER BY rolname;",
+                    (self.client_users,),
+                )
+                for user, verifier in cursor.fetchall():
+                    userlist.add(user, verifier)
+            conn.close()
         except psycopg2.Error:
+            logger.warning("Unable to fetch the client users verifiers")
             return
 
-        self.charm.set_secret(APP_SCOPE, password_key, password)
-        return hashed_password
+        if self.charm.set_userlist(userlist):
+            self.charm.render_auth_file()
+            # The followers reload on peer relation changed, the leader has to do it itself
+            self.charm._reload_pgbouncer()
+
+    def get_longest_transaction(self) -> Optional[float]:
+        """Returns the age in seconds of the oldest open transaction of the client users."""
+        try:
+            with self.postgres._connect_to_database() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COALESCE(EXTRACT(EPOCH FROM max(now() - xact_start)), 0) "
+                    "FROM pg_stat_activity WHERE usename = ANY(%s);",
+                    (self.client_users,),
+                )
+                age = cursor.fetchone()[0]
+            conn.close()
+        except psycopg2.Error:
+            logger.warning("Unable to fetch the client transactions")
+            return None
+        return float(age)
+
+    def get_idle_backend_pids(self, pids: List[int], host: Optional[str] = None) -> Set[int]:
+        """Returns which of the given backend processes are idle, outside of any transaction.
+
+        The processes are looked up on the given host, the primary by default.
+        """
+        try:
+            with self.postgres._connect_to_database(
+                database_host=host
+            ) as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pid FROM pg_stat_activity WHERE pid = ANY(%s) AND state = 'idle';",
+                    (pids,),
+                )
+                idle_pids = {row[0] for row in cursor.fetchall()}
+            conn.close()
+        except psycopg2.Error:
+            logger.warning("Unable to fetch the server connections activity")
+            return set()
+        return idle_pids
 
     def _on_database_created(self, event: DatabaseCreatedEvent) -> None:
         """Handle backend-database-database-created event.
@@ -191,26 +265,20 @@ class BackendDatabaseRequires(Object):
         # When the subordinate is booting up the relation may have already been initialised
         # or removed and re-added.
         try:
-            if (
-                not (auth_file := self.charm.get_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY))
-                or not self.auth_user
-                or self.auth_user not in auth_file
-            ):
-                auth_file = None
+            initialised = self.auth_user in self.charm.get_userlist()
         except ModelError:
             event.defer()
             logger.error("deferring database-created hook - cannot access secrets")
             return
-        if not self.charm.unit.is_leader() or (
-            auth_file and self.auth_user and self.auth_user in auth_file
-        ):
-            if not auth_file:
+        if not self.charm.unit.is_leader() or initialised:
+            if not initialised:
                 logger.debug("_on_database_created deferred: waiting for leader to initialise")
                 event.defer()
                 return
             self.charm.render_auth_file()
             self.charm.render_pgb_config()
             self.charm.render_prometheus_service()
+            self.charm.hacluster.render_health_env()
             self.charm.update_status()
             self.charm.client_relation.set_ready()
             return
@@ -248,34 +316,24 @@ class BackendDatabaseRequires(Object):
 
         hashed_password = get_md5_password(self.auth_user, plaintext_password)
 
-        # Add the monitoring user.
-        if not (
-            hashed_monitoring_password := self.generate_system_user(
-                self.stats_user, MONITORING_PASSWORD_KEY
-            )
-        ):
-            event.defer()
-            logger.error("deferring database-created hook - cannot monitoring hash password")
-            return
-
-        # Add the admin console user.
-        if not (
-            hashed_admin_password := self.generate_system_user(self.admin_user, ADMIN_PASSWORD_KEY)
-        ):
-            event.defer()
-            logger.error("deferring database-created hook - cannot admin hash password")
-            return
-
-        auth_file = (
-            f'"{self.auth_user}" "{hashed_password}"\n'
-            f'"{self.stats_user}" "{hashed_monitoring_password}"\n'
-            f'"{self.admin_user}" "{hashed_admin_password}"'
+        # Add the monitoring and admin console users.
+        hashed_monitoring_password = self.generate_system_user(
+            self.stats_user, MONITORING_PASSWORD_KEY
+        )
+        hashed_admin_password = self.generate_system_user(self.admin_user, ADMIN_PASSWORD_KEY)
+
+        self.charm.set_userlist(
+            UserList({
+                self.auth_user: hashed_password,
+                self.stats_user: hashed_monitoring_password,
+                self.admin_user: hashed_admin_password,
+            })
         )
-        self.charm.set_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY, auth_file)
 
         self.charm.render_auth_file()
         self.charm.render_pgb_config()
         self.charm.render_prometheus_service()
+        self.charm.hacluster.render_health_env()
         self.charm.client_relation.set_ready()
 
         self.charm.update_status()
@@ -283,6 +341,8 @@ class BackendDatabaseRequires(Object):
     def _on_endpoints_changed(self, _):
         self.charm.render_pgb_config()
         self.charm.update_client_connection_info()
+        # Pools are reopened against the new primary after a failover
+        self.charm.auto_prewarm_pools()
 
     def _on_relation_changed(self, _):
         if not self.charm.check_pgb_running():
@@ -524,11 +584,7 @@ class BackendDatabaseRequires(Object):
             return False
 
         try:
-            if (
-                not (auth_file := self.charm.get_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY))
-                or not self.auth_user
-                or self.auth_user not in auth_file
-            ):
+            if self.auth_user not in self.charm.get_userlist():
                 logger.debug("Backend not ready: no auth file secret set")
                 return False
         except ModelError:
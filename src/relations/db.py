@@ -228,7 +228,7 @@ class DbProvides(Object):
         if self._block_on_extensions(join_event.relation, remote_app_databag):
             return
 
-        user = self._generate_username(join_event.relation)
+        user = self._generate_username(join_event.relation.id)
         password = pgb.generate_password()
 
         if None in [database, password]:
@@ -283,6 +283,7 @@ class DbProvides(Object):
         self.charm.backend.initialise_auth_function([database])
 
         self.charm.backend.sync_hba(user)
+        self.charm.backend.sync_auth_file_users()
 
     def _on_relation_changed(self, change_event: RelationChangedEvent):
         """Handle db-relation-changed event.
@@ -306,7 +307,7 @@ class DbProvides(Object):
         # No backup values because if databag isn't populated, this relation isn't initialised.
         # This means that the database and user requested in this relation haven't been created,
         # so we defer this event until the databag is populated.
-        user = self._generate_username(change_event.relation)
+        user = self._generate_username(change_event.relation.id)
         databag = json.loads(self.charm.peers.app_databag.get(user, "{}"))
         database = databag.get("database")
         user = databag.get("user")
@@ -447,6 +448,7 @@ class DbProvides(Object):
                 # We've likely lost connection at this point, and can't do anything about a
                 # trailing user.
                 logger.exception(f"connection lost to PostgreSQL - unable to delete user {user}.")
+            self.charm.backend.sync_auth_file_users()
 
     def get_databags(self, relation):
         """Returns a list of writable databags for this unit."""
@@ -463,10 +465,9 @@ class DbProvides(Object):
 
         relation.data[self.charm.unit].update(updates)
 
-    def _generate_username(self, relation):
-        """Generates a unique username for this relation."""
+    def _generate_username(self, relation_id):
+        """Generates a unique username for the relation with the given id."""
         app_name = self.charm.app.name
-        relation_id = relation.id
         model_name = self.model.name
         return f"{app_name}_user_{relation_id}_{model_name}".replace("-", "_")
 
@@ -4,13 +4,22 @@
 
 import json
 import logging
+import os
 from hashlib import shake_128
 from ipaddress import IPv4Address, IPv6Address
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 
 from ops import CharmBase, Object, Relation, RelationChangedEvent, Unit
 
-from constants import HACLUSTER_RELATION_NAME
+from constants import (
+    APP_SCOPE,
+    HA_HEALTH_AGENT,
+    HACLUSTER_RELATION_NAME,
+    MONITORING_PASSWORD_KEY,
+    PGB,
+    PGB_CONF_DIR,
+    PGB_RUN_DIR,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -47,8 +56,64 @@ class HaCluster(Object):
 
         self.set_vip(self.charm.config.vip)
 
+    def _install_health_agent(self) -> None:
+        """Installs the OCF agent checking the pgbouncer instances, run by pacemaker as root."""
+        with open("templates/pgbouncer-health.ocf") as file:
+            agent = file.read()
+        os.makedirs(os.path.dirname(HA_HEALTH_AGENT), 0o755, exist_ok=True)
+        with open(HA_HEALTH_AGENT, "w") as file:
+            file.write(agent)
+        os.chmod(HA_HEALTH_AGENT, 0o700)
+
+    @property
+    def health_env_file(self) -> str:
+        """Path of the file holding the admin console connection string of the health agent."""
+        return f"{PGB_CONF_DIR}/{self.charm.app.name}/ha-health.env"
+
+    def render_health_env(self) -> None:
+        """Renders the credentials of the health agent, readable by root only.
+
+        The agent logs in as the stats user, whose password only exists once the backend is
+        initialised, so this is also rendered whenever the backend relation comes up.
+        """
+        if not self.relation:
+            return
+
+        stats_password = self.charm.get_secret(APP_SCOPE, MONITORING_PASSWORD_KEY)
+        if not stats_password:
+            logger.debug("health agent credentials not rendered: no monitoring password yet")
+            return
+
+        dsn = (
+            f"postgresql://{self.charm.backend.stats_user}:{stats_password}@/{PGB}?sslmode=disable"
+        )
+        fd = os.open(self.health_env_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            file.write(f'HEALTH_DSN="{dsn}"\n')
+
+    def _health_resource(self, key: str) -> Dict[str, str]:
+        """Resource definitions of the health check clone the VIP is colocated with."""
+        # Each instance group is checked on its own port, through its instances' sockets
+        sockets = " ".join(
+            f"{PGB_RUN_DIR}/{group}/instance_:{self.charm._get_listen_port(group)}"
+            for group, service_ids in self.charm.instance_groups.items()
+            if service_ids
+        )
+        params = " params"
+        params += f' sockets="{sockets}"'
+        params += f' env_file="{self.health_env_file}"'
+        # A single failure bans the unit until the failure expires
+        failure_timeout = self.charm.config.ha_failure_timeout
+        params += f' meta migration-threshold="1" failure-timeout="{failure_timeout}s"'
+        params += f' op monitor timeout="20s" interval="{self.charm.config.ha_monitor_interval}s"'
+        return {"resource": "ocf:pgbouncer:health", "params": params, "clone": f"cl_{key}"}
+
     def set_vip(self, vip: Optional[Union[IPv4Address, IPv6Address]]) -> None:
-        """Adds the requested virtual IP to the integration."""
+        """Adds the requested virtual IP to the integration.
+
+        The VIP is colocated with a clone of a health check resource, so that it only stays on
+        units whose pgbouncer instances are up.
+        """
         if not self.relation:
             return
 
@@ -70,15 +135,28 @@ class HaCluster(Object):
             # Monitor the VIP
             vip_params += ' meta migration-threshold="INFINITY" failure-timeout="5s"'
             vip_params += ' op monitor timeout="20s" interval="10s" depth="0"'
-            json_resources = json.dumps({vip_key: vip_resources})
-            json_resource_params = json.dumps({vip_key: vip_params})
+
+            self._install_health_agent()
+            self.render_health_env()
+            health_key = f"res_{self.charm.app.name}_health"
+            health = self._health_resource(health_key)
+            json_resources = json.dumps({vip_key: vip_resources, health_key: health["resource"]})
+            json_resource_params = json.dumps({vip_key: vip_params, health_key: health["params"]})
+            json_clones = json.dumps({health["clone"]: health_key})
+            json_colocations = json.dumps({
+                f"{vip_key}_with_health": f"inf: {vip_key} {health['clone']}"
+            })
 
         else:
             json_resources = "{}"
             json_resource_params = "{}"
+            json_clones = "{}"
+            json_colocations = "{}"
 
         self.relation.data[self.charm.unit].update({
             "json_resources": json_resources,
             "json_resource_params": json_resource_params,
+            "json_clones": json_clones,
+            "json_colocations": json_colocations,
         })
         self.charm.update_status()
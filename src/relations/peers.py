@@ -27,16 +27,25 @@ Example:
 
 import logging
 from hashlib import shake_128
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set
 
 from ops.charm import CharmBase, HookEvent
 from ops.framework import Object
 from ops.model import Relation, Unit
 
-from constants import APP_SCOPE, PEER_RELATION_NAME, UNIT_SCOPE, Scopes
+from constants import (
+    APP_SCOPE,
+    CLIENT_COUNT_MIN_CHANGE,
+    CLIENT_COUNT_MIN_RATIO,
+    PEER_RELATION_NAME,
+    UNIT_SCOPE,
+    Scopes,
+)
 
 ADDRESS_KEY = "private-address"
 LEADER_ADDRESS_KEY = "leader_ip"
+INSTANCES_COUNT_KEY = "instances_count"
+CLIENT_COUNT_KEY = "client_count"
 
 
 logger = logging.getLogger(__name__)
@@ -107,6 +116,34 @@ class Peers(Object):
         """Gets the IP of the leader unit."""
         return self.app_databag.get(LEADER_ADDRESS_KEY, None)
 
+    @property
+    def min_instances_count(self) -> int:
+        """Lowest pgbouncer instance count across the units.
+
+        Instances up to this count are available on every unit, so clients can be spread over
+        them regardless of the unit they are local to.
+        """
+        counts = [self.charm.instances_count]
+        if self.relation:
+            for unit in self.relation.units:
+                if unit == self.charm.unit:
+                    continue
+                if count := self.relation.data[unit].get(INSTANCES_COUNT_KEY):
+                    counts.append(int(count))
+        return min(counts)
+
+    @property
+    def client_counts(self) -> Dict[str, int]:
+        """Clients connected to each unit, by unit address, as last published by the units."""
+        counts = {}
+        if self.relation:
+            for unit in {self.charm.unit, *self.relation.units}:
+                if (ip := self._get_unit_ip(unit)) and (
+                    count := self.relation.data[unit].get(CLIENT_COUNT_KEY)
+                ):
+                    counts[ip] = int(count)
+        return counts
+
     @property
     def units(self) -> List[Unit]:
         """Returns the peer relation units."""
@@ -132,6 +169,7 @@ class Peers(Object):
     def _on_changed(self, event: HookEvent):
         """If the current unit is a follower, write updated config and auth files to filesystem."""
         self.unit_databag.update({ADDRESS_KEY: self.charm.unit_ip})
+        self.update_instances_count()
 
         if not self.charm.upgrade.idle:
             logger.debug("Defer on_start: Cluster is upgrading")
@@ -143,6 +181,7 @@ class Peers(Object):
 
         if self.charm.backend.postgres:
             self.charm.render_prometheus_service()
+            self.charm.hacluster.render_health_env()
 
         pgb_dbs_hash = shake_128(self.app_databag.get("pgb_dbs_config", "{}").encode()).hexdigest(
             16
@@ -153,6 +192,27 @@ class Peers(Object):
     def _on_departed(self, _):
         self.update_leader()
 
+    def update_instances_count(self):
+        """Publishes the number of pgbouncer instances running on this unit."""
+        if self.unit_databag is not None:
+            self.unit_databag[INSTANCES_COUNT_KEY] = str(self.charm.instances_count)
+
+    def update_client_count(self, count: int) -> None:
+        """Publishes the number of clients connected to this unit.
+
+        Small changes are left out, so that client endpoints ordered by load aren't reshuffled,
+        and the peers woken up, on every status update.
+        """
+        if self.unit_databag is None:
+            return
+        if (published := self.unit_databag.get(CLIENT_COUNT_KEY)) is not None:
+            published = int(published)
+            if abs(count - published) < max(
+                CLIENT_COUNT_MIN_CHANGE, published * CLIENT_COUNT_MIN_RATIO
+            ):
+                return
+        self.unit_databag[CLIENT_COUNT_KEY] = str(count)
+
     def update_leader(self):
         """Updates leader hostname in peer databag to match this unit if it's the leader."""
         if self.charm.unit.is_leader():
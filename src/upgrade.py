@@ -5,7 +5,8 @@
 
 import json
 import logging
-from typing import List
+import time
+from typing import Dict, List, Optional
 
 import psycopg2
 from charms.data_platform_libs.v0.upgrade import (
@@ -15,7 +16,9 @@ from charms.data_platform_libs.v0.upgrade import (
     UpgradeGrantedEvent,
 )
 from charms.operator_libs_linux.v1 import systemd
-from charms.pgbouncer_k8s.v0.pgb import generate_password
+from charms.operator_libs_linux.v2 import snap
+from charms.pgbouncer_k8s.v0.pgb import generate_password, get_scram_password
+from ops.charm import ActionEvent
 from ops.model import MaintenanceStatus
 from pydantic import BaseModel
 from tenacity import Retrying, stop_after_attempt, wait_fixed
@@ -24,10 +27,10 @@ from typing_extensions import override
 from constants import (
     ADMIN_PASSWORD_KEY,
     APP_SCOPE,
-    AUTH_FILE_DATABAG_KEY,
     MONITORING_PASSWORD_KEY,
     PGB,
     PGB_CONF_DIR,
+    PGB_DRAIN_TIMEOUT,
     SNAP_PACKAGES,
 )
 
@@ -57,6 +60,7 @@ class PgbouncerUpgrade(DataUpgrade):
         """Initialize the class."""
         super().__init__(charm, model, **kwargs)
         self.charm = charm
+        self.pool_state: Optional[Dict] = None
 
     @override
     def build_upgrade_stack(self) -> List[int]:
@@ -85,64 +89,146 @@ class PgbouncerUpgrade(DataUpgrade):
         if self.charm.get_secret(APP_SCOPE, ADMIN_PASSWORD_KEY):
             return
 
-        auth_file = self.charm.get_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY)
-        if not (
-            hashed_password := self.charm.backend.generate_system_user(
+        userlist = self.charm.get_userlist()
+        userlist.add(
+            self.charm.backend.admin_user,
+            self.charm.backend.generate_system_user(
                 self.charm.backend.admin_user, ADMIN_PASSWORD_KEY
-            )
-        ):
-            logger.error("Failed to generate admin console user")
-            return
-        self.charm.set_secret(
-            APP_SCOPE,
-            AUTH_FILE_DATABAG_KEY,
-            f'{auth_file}\n"{self.charm.backend.admin_user}" "{hashed_password}"',
+            ),
         )
+        self.charm.set_userlist(userlist)
 
     def _handle_md5_monitoring_auth(self) -> None:
-        if not self.charm.unit.is_leader() or not (
-            auth_file := self.charm.get_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY)
-        ):
+        if not self.charm.unit.is_leader():
             return
 
-        monitoring_prefix = f'"{self.charm.backend.stats_user}" "md5'
         # Regenerate monitoring user if it is still md5
-        new_auth = []
-        for line in auth_file.split("\n"):
-            if line.startswith(monitoring_prefix):
-                stats_password = self.charm.get_secret(APP_SCOPE, MONITORING_PASSWORD_KEY)
+        userlist = self.charm.get_userlist()
+        stats_user = self.charm.backend.stats_user
+        if (userlist.get(stats_user) or "").startswith("md5"):
+            stats_password = self.charm.get_secret(APP_SCOPE, MONITORING_PASSWORD_KEY)
+            userlist.add(stats_user, get_scram_password(stats_user, stats_password))
+            self.charm.set_userlist(userlist)
+
+    def _get_pool_state(self) -> Dict:
+        """Collects the client and server counts of every instance of the unit."""
+        instances = {}
+        for group, service_ids in self.charm.instance_groups.items():
+            for service_id in service_ids:
                 try:
-                    hashed_monitoring_password = self.charm.backend.generate_scram_hash(
-                        self.charm.backend.stats_user, stats_password
-                    )
-                except psycopg2.Error:
-                    logger.error(
-                        "Cannot generate SCRAM monitoring password. Keeping existing MD5 hash"
+                    pools = self.charm.admin_console_query(group, service_id, "SHOW POOLS;")
+                    clients = self.charm.admin_console_query(group, service_id, "SHOW CLIENTS;")
+                except psycopg2.Error as e:
+                    logger.warning(f"Unable to get the pools of {group}@{service_id}: {e}")
+                    continue
+                # Leave out the admin console, including this very connection
+                pools = [pool for pool in pools if pool["database"] != PGB]
+                instances[f"{group}-{service_id}"] = {
+                    "pools": len(pools),
+                    "clients": len([client for client in clients if client["database"] != PGB]),
+                    "active-clients": sum(pool["cl_active"] for pool in pools),
+                    "waiting-clients": sum(pool["cl_waiting"] for pool in pools),
+                    "active-servers": sum(pool["sv_active"] for pool in pools),
+                }
+
+        state = {"instances": instances}
+        if (
+            self.charm.backend.postgres
+            and (age := self.charm.backend.get_longest_transaction()) is not None
+        ):
+            state["longest-transaction"] = round(age, 1)
+        return state
+
+    def _pause_services(self, timeout: float) -> None:
+        """Pauses every instance, which waits for their in-flight transactions to finish."""
+        self.charm.unit.status = MaintenanceStatus("waiting for transactions to finish")
+        deadline = time.monotonic() + timeout
+        for group, service_ids in self.charm.instance_groups.items():
+            for service_id in service_ids:
+                try:
+                    self.charm.admin_console_query(
+                        group, service_id, "PAUSE;", max(deadline - time.monotonic(), 0)
                     )
-                    return
-                new_auth.append(
-                    f'"{self.charm.backend.stats_user}" "{hashed_monitoring_password}"'
-                )
-            else:
-                new_auth.append(line)
-        new_auth_file = "\n".join(new_auth)
-        if new_auth_file != auth_file:
-            self.charm.set_secret(APP_SCOPE, AUTH_FILE_DATABAG_KEY, new_auth_file)
+                except psycopg2.Error as e:
+                    logger.warning(f"Unable to pause {group}@{service_id}: {e}")
 
-    @override
-    def _on_upgrade_granted(self, event: UpgradeGrantedEvent) -> None:
-        # Refresh the charmed PostgreSQL snap and restart the database.
+    def _stop_services(self) -> None:
+        if self.charm.config.upgrade_drain_timeout:
+            self._pause_services(self.charm.config.upgrade_drain_timeout)
         self.charm.unit.status = MaintenanceStatus("stopping services")
         # If pgb is upgraded from a version that only uses cpu count excess services should be stopped
-        for i in self.charm.service_ids:
-            service = f"{PGB}-{self.charm.app.name}@{i}"
+        for service in self.charm.pgb_services:
             if systemd.service_running(service):
                 systemd.service_stop(service)
-        if self.charm.backend.postgres:
-            self.charm.remove_exporter_service()
 
+    def _refresh_snap(self, rolling: bool) -> bool:
+        """Refreshes the snap, under the running instances for rolling upgrades.
+
+        Returns:
+            Whether the instances are still running and need a rolling restart.
+        """
+        if not rolling:
+            self._stop_services()
         self.charm.unit.status = MaintenanceStatus("refreshing the snap")
-        self.charm._install_snap_packages(packages=SNAP_PACKAGES, refresh=True)
+        try:
+            self.charm._install_snap_packages(packages=SNAP_PACKAGES, refresh=True)
+        except snap.SnapError:
+            if not rolling:
+                raise
+            # snapd can refuse to refresh a snap with running apps
+            logger.warning("Unable to refresh the snap under running instances, stopping them")
+            self._stop_services()
+            self.charm._install_snap_packages(packages=SNAP_PACKAGES, refresh=True)
+            return False
+        return rolling
+
+    def _rolling_restart(self) -> None:
+        """Hands the clients of each instance over to new version instances, one at a time.
+
+        Groups with a single instance get a temporary extra one, so that there is always an
+        instance accepting connections on the shared port while the others drain. The instances
+        share a single drain deadline, so that the hook doesn't grow with the instance count.
+        The handoff instances only start draining once the instances their clients came from
+        are back, so they get a deadline of their own rather than what is left of it.
+
+        Instances older than pgbouncer 1.23 can't hand their clients over: they are paused to
+        let the in-flight queries finish, then restarted with their clients attached.
+        """
+        self.charm.unit.status = MaintenanceStatus("draining services")
+        timeout = self.charm.config.upgrade_drain_timeout or PGB_DRAIN_TIMEOUT
+        deadline = time.monotonic() + timeout
+        handoff = {}
+        for group, service_ids in self.charm.instance_groups.items():
+            if len(service_ids) == 1:
+                service_ids.append(1)
+                handoff[group] = 1
+        if handoff:
+            self.charm.create_instance_directories()
+            self.charm.render_pgb_config()
+
+        for group, service_ids in self.charm.instance_groups.items():
+            for service_id in service_ids:
+                if handoff.get(group) != service_id:
+                    self.charm.drain_instance(
+                        group, service_id, max(deadline - time.monotonic(), 0)
+                    )
+
+        deadline = time.monotonic() + timeout
+        for group, service_id in handoff.items():
+            self.charm.drain_instance(
+                group, service_id, max(deadline - time.monotonic(), 0), restart=False
+            )
+            self.charm.instance_groups[group].remove(service_id)
+        if handoff:
+            self.charm.update_instances()
+            self.charm.render_pgb_config()
+
+    @override
+    def _on_upgrade_granted(self, event: UpgradeGrantedEvent) -> None:
+        # Refresh the charmed PostgreSQL snap and restart the database.
+        if self.charm.backend.postgres:
+            self.charm.remove_exporter_service()
+        rolling = self._refresh_snap(self.charm.config.upgrade_strategy == "rolling")
 
         self.charm.unit.status = MaintenanceStatus("restarting services")
         if self.charm.unit.is_leader():
@@ -163,10 +249,13 @@ class PgbouncerUpgrade(DataUpgrade):
         self.charm.render_pgb_config()
         if self.charm.backend.postgres:
             self.charm.render_prometheus_service()
+        if rolling:
+            self._rolling_restart()
 
         for attempt in Retrying(stop=stop_after_attempt(6), wait=wait_fixed(10), reraise=True):
             with attempt:
                 self._cluster_checks()
+        self.charm.auto_prewarm_pools()
 
         self.set_unit_completed()
         self.charm.update_status()
@@ -185,3 +274,12 @@ class PgbouncerUpgrade(DataUpgrade):
             :class:`ClusterNotReadyError`: if cluster is not ready to upgrade
         """
         self._cluster_checks()
+        self.pool_state = self._get_pool_state()
+
+    @override
+    def _on_pre_upgrade_check_action(self, event: ActionEvent) -> None:
+        """Runs the pre-upgrade checks and reports the pool state of the unit instances."""
+        self.pool_state = None
+        super()._on_pre_upgrade_check_action(event)
+        if self.pool_state is not None:
+            event.set_results(self.pool_state)
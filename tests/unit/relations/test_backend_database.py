@@ -132,7 +132,7 @@ class TestBackendDatabaseRelation(unittest.TestCase):
         mock_event.defer.assert_called_once_with()
 
         # Stale secret
-        _get_secret.return_value = '"AUTH_USER"'
+        _get_secret.return_value = '"AUTH_USER" "md5hash"'
 
         self.backend._on_database_created(mock_event)
 
@@ -233,6 +233,87 @@ class TestBackendDatabaseRelation(unittest.TestCase):
             )
             conn.close.assert_called()
 
+    @patch("charm.PgBouncerCharm._reload_pgbouncer")
+    @patch("charm.PgBouncerCharm.render_auth_file")
+    @patch("charm.PgBouncerCharm.set_secret")
+    @patch("charm.PgBouncerCharm.get_secret")
+    @patch(
+        "charm.PgBouncerCharm.get_relation_databases",
+        return_value={
+            "1": {"name": "db", "legacy": False},
+            "2": {"name": "legacy_db", "legacy": True},
+            "*": {"name": "*", "auth_dbname": "legacy_db"},
+        },
+    )
+    @patch(
+        "relations.backend_database.BackendDatabaseRequires.admin_user",
+        new_callable=PropertyMock,
+        return_value="admin_user",
+    )
+    @patch(
+        "relations.backend_database.BackendDatabaseRequires.stats_user",
+        new_callable=PropertyMock,
+        return_value="stats_user",
+    )
+    @patch(
+        "relations.backend_database.BackendDatabaseRequires.auth_user",
+        new_callable=PropertyMock,
+        return_value="user",
+    )
+    @patch(
+        "relations.backend_database.BackendDatabaseRequires.postgres", new_callable=PropertyMock
+    )
+    def test_sync_auth_file_users(
+        self,
+        _postgres,
+        _,
+        __,
+        ___,
+        _get_dbs,
+        _get_secret,
+        _set_secret,
+        _render_auth_file,
+        _reload_pgbouncer,
+    ):
+        _get_secret.return_value = (
+            '"user" "md5hash"\n'
+            '"stats_user" "stats-hash"\n'
+            '"admin_user" "admin-hash"\n'
+            '"relation_id_3" "stale-hash"'
+        )
+        cursor = _postgres.return_value._connect_to_database().__enter__().cursor().__enter__()
+        cursor.fetchall.return_value = [("relation_id_1", "SCRAM-SHA-256$4096:salt$keys")]
+
+        # Followers don't touch the auth file.
+        self.backend.sync_auth_file_users()
+        assert not cursor.execute.called
+
+        with self.harness.hooks_disabled():
+            self.harness.set_leader(True)
+        self.backend.sync_auth_file_users()
+
+        assert cursor.execute.call_args[0][1] == (
+            ["relation_id_1", f"pgbouncer_user_2_{self.charm.model.name}".replace("-", "_")],
+        )
+        _set_secret.assert_called_once_with(
+            "app",
+            "auth_file",
+            '"user" "md5hash"\n'
+            '"stats_user" "stats-hash"\n'
+            '"admin_user" "admin-hash"\n'
+            '"relation_id_1" "SCRAM-SHA-256$4096:salt$keys"',
+        )
+        _render_auth_file.assert_called_once_with()
+        _reload_pgbouncer.assert_called_once_with()
+
+        # Nothing is published when the users didn't change.
+        _get_secret.return_value = _set_secret.call_args[0][2]
+        _set_secret.reset_mock()
+        _reload_pgbouncer.reset_mock()
+        self.backend.sync_auth_file_users()
+        assert not _set_secret.called
+        assert not _reload_pgbouncer.called
+
     @patch(
         "relations.backend_database.BackendDatabaseRequires.ready",
         new_callable=PropertyMock,
@@ -1,6 +1,8 @@
 # Copyright 2024 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import json
+import os
 from ipaddress import IPv4Address, IPv6Address
 from unittest import TestCase
 from unittest.mock import Mock, PropertyMock, patch
@@ -67,8 +69,18 @@ class TestHaCluster(TestCase):
 
         assert not _is_clustered.called
 
+    @patch("charm.HaCluster.render_health_env")
+    @patch("charm.HaCluster._install_health_agent")
     @patch("charm.HaCluster._is_clustered", return_value=False)
-    def test_set_vip(self, _is_clustered):
+    def test_set_vip(self, _is_clustered, _install_health_agent, _render_health_env):
+        health_params = (
+            '"res_pgbouncer_health": " params '
+            'sockets=\\"/var/snap/charmed-pgbouncer/current/run/pgbouncer/pgbouncer/instance_:6432\\" '
+            'env_file=\\"/var/snap/charmed-pgbouncer/current/etc/pgbouncer/pgbouncer/'
+            'ha-health.env\\" meta '
+            'migration-threshold=\\"1\\" failure-timeout=\\"60s\\" op monitor '
+            'timeout=\\"20s\\" interval=\\"5s\\""'
+        )
         # Not clustered
         self.charm.hacluster.set_vip(IPv4Address("1.2.3.4"))
         assert self.harness.get_relation_data(self.rel_id, self.charm.unit) == {}
@@ -78,25 +90,51 @@ class TestHaCluster(TestCase):
 
         self.charm.hacluster.set_vip(IPv4Address("1.2.3.4"))
 
+        _install_health_agent.assert_called_once_with()
+        _render_health_env.assert_called_once_with()
         assert self.harness.get_relation_data(self.rel_id, self.charm.unit) == {
             "json_resource_params": '{"res_pgbouncer_d716ce1885885a_vip": " params '
             'ip=\\"1.2.3.4\\" meta '
             'migration-threshold=\\"INFINITY\\" '
             'failure-timeout=\\"5s\\" op monitor '
-            'timeout=\\"20s\\" interval=\\"10s\\" depth=\\"0\\""}',
-            "json_resources": '{"res_pgbouncer_d716ce1885885a_vip": "ocf:heartbeat:IPaddr2"}',
+            'timeout=\\"20s\\" interval=\\"10s\\" depth=\\"0\\"", ' + health_params + "}",
+            "json_resources": '{"res_pgbouncer_d716ce1885885a_vip": "ocf:heartbeat:IPaddr2", '
+            '"res_pgbouncer_health": "ocf:pgbouncer:health"}',
+            "json_clones": '{"cl_res_pgbouncer_health": "res_pgbouncer_health"}',
+            "json_colocations": '{"res_pgbouncer_d716ce1885885a_vip_with_health": '
+            '"inf: res_pgbouncer_d716ce1885885a_vip cl_res_pgbouncer_health"}',
         }
 
-        # ipv6 address
+        # ipv6 address, with tuned health checks and read-only instances
+        with self.harness.hooks_disabled():
+            self.harness.update_config({
+                "ha_monitor_interval": 2,
+                "ha_failure_timeout": 30,
+                "readonly_listen_port": 6433,
+            })
+        self.charm.readonly_service_ids.append(0)
         self.charm.hacluster.set_vip(IPv6Address("::1"))
 
-        assert self.harness.get_relation_data(self.rel_id, self.charm.unit) == {
-            "json_resource_params": '{"res_pgbouncer_61b6532057c944_vip": " params '
-            'ipv6addr=\\"::1\\" meta '
-            'migration-threshold=\\"INFINITY\\" '
-            'failure-timeout=\\"5s\\" op monitor '
-            'timeout=\\"20s\\" interval=\\"10s\\" depth=\\"0\\""}',
-            "json_resources": '{"res_pgbouncer_61b6532057c944_vip": "ocf:heartbeat:IPv6addr"}',
+        data = self.harness.get_relation_data(self.rel_id, self.charm.unit)
+        assert data["json_resources"] == (
+            '{"res_pgbouncer_61b6532057c944_vip": "ocf:heartbeat:IPv6addr", '
+            '"res_pgbouncer_health": "ocf:pgbouncer:health"}'
+        )
+        params = json.loads(data["json_resource_params"])
+        assert params["res_pgbouncer_61b6532057c944_vip"] == (
+            ' params ipv6addr="::1" meta migration-threshold="INFINITY" failure-timeout="5s"'
+            ' op monitor timeout="20s" interval="10s" depth="0"'
+        )
+        assert 'failure-timeout="30s"' in params["res_pgbouncer_health"]
+        assert 'interval="2s"' in params["res_pgbouncer_health"]
+        assert (
+            'sockets="/var/snap/charmed-pgbouncer/current/run/pgbouncer/pgbouncer/instance_:6432 '
+            '/var/snap/charmed-pgbouncer/current/run/pgbouncer/pgbouncer-ro/instance_:6433"'
+        ) in params["res_pgbouncer_health"]
+        assert json.loads(data["json_colocations"]) == {
+            "res_pgbouncer_61b6532057c944_vip_with_health": (
+                "inf: res_pgbouncer_61b6532057c944_vip cl_res_pgbouncer_health"
+            )
         }
 
         # unset data
@@ -104,4 +142,37 @@ class TestHaCluster(TestCase):
         assert self.harness.get_relation_data(self.rel_id, self.charm.unit) == {
             "json_resource_params": "{}",
             "json_resources": "{}",
+            "json_clones": "{}",
+            "json_colocations": "{}",
         }
+
+    @patch(
+        "relations.backend_database.BackendDatabaseRequires.stats_user",
+        new_callable=PropertyMock,
+        return_value="pgbouncer_stats_pgbouncer",
+    )
+    @patch("charm.PgBouncerCharm.get_secret", return_value=None)
+    def test_render_health_env(self, _get_secret, _stats_user):
+        env_file = self.charm.hacluster.health_env_file
+        with patch("relations.hacluster.os.open") as _open, patch(
+            "relations.hacluster.os.fdopen"
+        ) as _fdopen:
+            # No monitoring password yet
+            self.charm.hacluster.render_health_env()
+            assert not _open.called
+
+            _get_secret.return_value = "stats_pass"
+            self.charm.hacluster.render_health_env()
+
+            _open.assert_called_once_with(env_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            _fdopen.assert_called_once_with(_open.return_value, "w")
+            _fdopen.return_value.__enter__.return_value.write.assert_called_once_with(
+                'HEALTH_DSN="postgresql://pgbouncer_stats_pgbouncer:stats_pass@/pgbouncer'
+                '?sslmode=disable"\n'
+            )
+
+            # No hacluster relation
+            _open.reset_mock()
+            self.harness.remove_relation(self.rel_id)
+            self.charm.hacluster.render_health_env()
+            assert not _open.called
@@ -52,3 +52,28 @@ class TestPeers(unittest.TestCase):
         self.charm.peers._on_changed(MagicMock())
         render_pgb_config.assert_called_once_with()
         render_pgb_config.reset_mock()
+
+    def test_client_counts(self):
+        with self.harness.hooks_disabled():
+            self.harness.add_relation_unit(self.rel_id, f"{self.app}/1")
+            self.harness.update_relation_data(
+                self.rel_id, f"{self.app}/1", {"private-address": "192.0.2.1", "client_count": "7"}
+            )
+        assert self.charm.peers.client_counts == {"192.0.2.1": 7}
+
+        # Published when first known
+        self.charm.peers.update_client_count(3)
+        assert self.charm.peers.client_counts == {"192.0.2.0": 3, "192.0.2.1": 7}
+
+        # Small changes aren't published
+        self.charm.peers.update_client_count(12)
+        assert self.charm.peers.client_counts["192.0.2.0"] == 3
+        self.charm.peers.update_client_count(13)
+        assert self.charm.peers.client_counts["192.0.2.0"] == 13
+
+        # Nor are changes under a fifth of the published count
+        self.charm.peers.update_client_count(1000)
+        self.charm.peers.update_client_count(1150)
+        assert self.charm.peers.client_counts["192.0.2.0"] == 1000
+        self.charm.peers.update_client_count(790)
+        assert self.charm.peers.client_counts["192.0.2.0"] == 790
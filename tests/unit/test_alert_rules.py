@@ -0,0 +1,65 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import uuid
+
+import yaml
+from cosl import JujuTopology
+from cosl.rules import AlertRules
+
+RULES_DIR = "src/prometheus_alert_rules"
+# promtool fixtures, run with `promtool test rules tests/alerts/*.yaml`
+RULES_TESTS = "tests/alerts/pgbouncer_rules_test.yaml"
+
+
+def _load_rules() -> dict:
+    rules = AlertRules(
+        query_type="promql",
+        topology=JujuTopology(
+            model="test",
+            model_uuid=str(uuid.uuid4()),
+            application="pgbouncer",
+            charm_name="pgbouncer",
+        ),
+    )
+    rules.add_path(RULES_DIR, recursive=True)
+    return {rule["alert"]: rule for group in rules.as_dict()["groups"] for rule in group["rules"]}
+
+
+def test_alert_rules():
+    rules = _load_rules()
+
+    assert set(rules) == {
+        "PgBouncerExporterDown",
+        "PgBouncerDown",
+        "PgBouncerClientsWaiting",
+        "PgBouncerClientMaxWaitHigh",
+        "PgBouncerDatabaseConnectionsNearLimit",
+        "PgBouncerClientConnectionsNearLimit",
+        "PgBouncerInstanceLoadSkew",
+    }
+    for name, rule in rules.items():
+        assert rule["labels"]["severity"] in ("warning", "critical"), name
+        assert rule["labels"]["juju_application"] == "pgbouncer", name
+        assert rule.get("for"), name
+        assert rule["annotations"]["summary"], name
+        assert rule["annotations"]["description"], name
+
+
+def test_alert_rules_fixtures():
+    rules = _load_rules()
+    with open(RULES_TESTS) as file:
+        fixtures = yaml.safe_load(file)
+
+    assert fixtures["rule_files"] == [f"../../{RULES_DIR}/pgbouncer.rules"]
+    firing = set()
+    for test in fixtures["tests"]:
+        for case in test["alert_rule_test"]:
+            rule = rules[case["alertname"]]
+            for alert in case["exp_alerts"]:
+                firing.add(case["alertname"])
+                # Expected alerts carry the rule labels and annotations
+                assert alert["exp_labels"]["severity"] == rule["labels"]["severity"]
+                assert set(alert["exp_annotations"]) == set(rule["annotations"])
+    # Every rule is shown to fire at least once
+    assert firing == set(rules)
@@ -31,12 +31,33 @@ from constants import (
     PGB_CONF_DIR,
     PGB_LOG_DIR,
     PGB_RUN_DIR,
+    PGBOUNCER_EXECUTABLE,
     SECRET_INTERNAL_LABEL,
     SNAP_PACKAGES,
+    SNAP_TMP_DIR,
 )
 
 DATA_DIR = "tests/unit/data"
 TEST_VALID_INI = f"{DATA_DIR}/test.ini"
+DEFAULT_TUNING = {
+    "server_idle_timeout": 600,
+    "server_lifetime": 3600,
+    "query_wait_timeout": 120,
+    "idle_transaction_timeout": 0,
+    "pkt_buf": 4096,
+    "sbuf_loopcnt": 5,
+    "tcp_keepalive": 1,
+    "server_check_delay": 30,
+    "listen_backlog": 128,
+}
+
+DEFAULT_LOGGING = {
+    "log_connections": 1,
+    "log_disconnections": 1,
+    "log_pooler_errors": 1,
+    "log_stats": 1,
+    "stats_period": 60,
+}
 
 ops.testing.SIMULATE_CAN_CONNECT = True
 
@@ -205,9 +226,10 @@ class TestCharm(unittest.TestCase):
         assert self.charm.check_pgb_running()
         _running.assert_any_call("pgbouncer-pgbouncer@0")
 
+    @patch("charm.PgBouncerCharm.render_logrotate")
     @patch("charm.PgBouncerCharm.render_pgb_config")
     @patch("relations.peers.Peers.app_databag", new_callable=PropertyMock)
-    def test_on_config_changed(self, _app_databag, _render):
+    def test_on_config_changed(self, _app_databag, _render, _render_logrotate):
         self.harness.add_relation(BACKEND_RELATION_NAME, "postgres")
         self.harness.set_leader()
         mock_cores = 1
@@ -223,6 +245,7 @@ class TestCharm(unittest.TestCase):
 
         # _read.return_value is modified on config update, but the object reference is the same.
         _render.assert_called_with(restart=True)
+        _render_logrotate.assert_called_once_with()
 
     @patch("charm.snap.SnapCache")
     def test_install_snap_packages(self, _snap_cache):
@@ -324,6 +347,15 @@ class TestCharm(unittest.TestCase):
         _chmod.assert_called_with(path, mode)
         _getpwnam.assert_called_with("snap_daemon")
         _chown.assert_called_with(path, uid=1100, gid=120)
+        _chmod.reset_mock()
+
+        # Files already holding the content are left alone
+        rendered = unittest.mock.mock_open(read_data=content)
+        with patch("os.path.exists", return_value=True), patch("builtins.open", rendered):
+            assert not self.charm.render_file_if_changed(path, content, mode)
+            assert self.charm.render_file_if_changed(path, "new content", mode)
+
+        _chmod.assert_called_once_with(path, mode)
 
     @patch(
         "charm.PgBouncerCharm.conf_auth_file",
@@ -345,8 +377,12 @@ class TestCharm(unittest.TestCase):
     @patch("charm.PgBouncerCharm.get_relation_databases")
     @patch("charm.PgBouncerCharm._reload_pgbouncer")
     @patch("charm.PgBouncerCharm.render_file")
+    @patch("charm.PgBouncerCharm.version", new_callable=PropertyMock, return_value="1.21.0")
+    @patch("charm.PgBouncerCharm._get_available_memory", return_value=4 * 1024**3)
     def test_render_pgb_config(
         self,
+        _get_available_memory,
+        _version,
         _render,
         _reload,
         _get_dbs,
@@ -408,9 +444,14 @@ class TestCharm(unittest.TestCase):
             listen_port=6432,
             pool_mode="session",
             max_db_connections=100,
+            max_client_conn=65036,
+            max_prepared_statements=0,
+            load_balance_hosts=None,
             default_pool_size=default_pool_size,
             min_pool_size=min_pool_size,
             reserve_pool_size=reserve_pool_size,
+            tuning=DEFAULT_TUNING,
+            logging=DEFAULT_LOGGING,
             admin_user="pgbouncer_admin_pgbouncer",
             stats_user="pgbouncer_stats_pgbouncer",
             auth_type="scram-sha-256",
@@ -456,9 +497,14 @@ class TestCharm(unittest.TestCase):
             listen_port=6432,
             pool_mode="session",
             max_db_connections=0,
+            max_client_conn=65286,
+            max_prepared_statements=0,
+            load_balance_hosts=None,
             default_pool_size=20,
             min_pool_size=10,
             reserve_pool_size=10,
+            tuning=DEFAULT_TUNING,
+            logging=DEFAULT_LOGGING,
             admin_user="pgbouncer_admin_pgbouncer",
             stats_user="pgbouncer_stats_pgbouncer",
             auth_type="scram-sha-256",
@@ -470,6 +516,488 @@ class TestCharm(unittest.TestCase):
             f"{PGB_CONF_DIR}/pgbouncer/instance_0/pgbouncer.ini", expected_content, 0o700
         )
 
+    @patch("config.os.cpu_count", return_value=4)
+    def test_readonly_listen_port_config(self, _cpu_count):
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"instances_count": "2", "readonly_listen_port": 6433})
+        assert self.charm.configuration_check()
+
+        # The port of the main listener and those of the exporters are taken
+        for port in [6432, 9127, 9129]:
+            with self.harness.hooks_disabled():
+                self.harness.update_config({"readonly_listen_port": port})
+            assert not self.charm.configuration_check()
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_listen_port": 9130})
+        assert self.charm.configuration_check()
+
+        # The automatic instance count is bounded by the cores
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"instances_count": "auto"})
+        assert not self.charm.configuration_check()
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_listen_port": 9132})
+        assert self.charm.configuration_check()
+
+        # Disabled listener
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_listen_port": 0})
+        assert self.charm.configuration_check()
+
+    def test_tuning(self):
+        assert self.charm.config.tuning.dict() == DEFAULT_TUNING
+
+        # Profile settings
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"tuning_profile": "analytics"})
+        assert self.charm.config.tuning.dict() == {
+            **DEFAULT_TUNING,
+            "server_idle_timeout": 1800,
+            "server_lifetime": 7200,
+            "query_wait_timeout": 600,
+            "pkt_buf": 16384,
+            "sbuf_loopcnt": 20,
+            "server_check_delay": 60,
+        }
+
+        # Overrides take precedence over the profile
+        with self.harness.hooks_disabled():
+            self.harness.update_config({
+                "tuning_profile": "oltp",
+                "tuning_overrides": "query_wait_timeout=5 tcp_keepalive=0",
+            })
+        tuning = self.charm.config.tuning
+        assert tuning.query_wait_timeout == 5
+        assert tuning.tcp_keepalive == 0
+        assert tuning.listen_backlog == 1024
+
+        # Unknown settings, invalid values and malformed overrides are rejected
+        for overrides in ["max_client_conn=10", "pkt_buf=512", "query_wait_timeout"]:
+            with self.harness.hooks_disabled():
+                self.harness.update_config({"tuning_overrides": overrides})
+            assert not self.charm.configuration_check()
+
+        # Unknown profile
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"tuning_profile": "fast", "tuning_overrides": ""})
+        assert not self.charm.configuration_check()
+
+    def test_logging(self):
+        assert self.charm.config.logging == DEFAULT_LOGGING
+        assert self.charm._log_slots == ["charmed-pgbouncer:logs"]
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_connections": False, "stats_period": 300})
+        assert self.charm.config.logging == {
+            **DEFAULT_LOGGING,
+            "log_connections": 0,
+            "stats_period": 300,
+        }
+
+        # Quiet mode overrides the individual options and doesn't forward the logs
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_mode": "quiet"})
+        assert self.charm.config.logging == {
+            "log_connections": 0,
+            "log_disconnections": 0,
+            "log_pooler_errors": 0,
+            "log_stats": 0,
+            "stats_period": 300,
+        }
+        assert self.charm._log_slots == []
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_mode": "silent"})
+        assert not self.charm.configuration_check()
+
+    @patch("os.cpu_count", return_value=8)
+    @patch("charm.PgBouncerCharm._get_available_memory", return_value=None)
+    def test_get_connection_limits(self, _get_available_memory, _):
+        # Bound by the file descriptors left after the server connections of every database
+        assert self.charm.get_connection_limits(2) == {
+            "fd-limit": 65536,
+            "instances": 1,
+            "server-connections": 200,
+            "max-client-conn": 65236,
+            "total-max-client-conn": 65236,
+        }
+
+        # Bound by the memory share of each instance
+        _get_available_memory.return_value = 1024**3
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"max_db_connections": 0, "instances_count": "2"})
+        assert self.charm.get_connection_limits(2) == {
+            "fd-limit": 65536,
+            "instances": 2,
+            "server-connections": 60,
+            "memory-budget": 134217728,
+            "max-client-conn": 16324,
+            "total-max-client-conn": 32648,
+        }
+
+        # Never drops below the reserve
+        _get_available_memory.return_value = 1024**2
+        assert self.charm.get_connection_limits(2)["max-client-conn"] == 100
+
+    def test_get_available_memory(self):
+        meminfo = "MemTotal:       16384000 kB\nMemFree:         1024000 kB\nMemAvailable:    8192000 kB\n"
+        with patch("builtins.open", unittest.mock.mock_open(read_data=meminfo)):
+            assert self.charm._get_available_memory() == 8192000 * 1024
+
+        with patch("builtins.open", side_effect=OSError):
+            assert self.charm._get_available_memory() is None
+
+    @patch("charm.PgBouncerCharm._get_available_memory", return_value=None)
+    def test_on_get_connection_limits(self, _):
+        event = Mock()
+
+        self.charm._on_get_connection_limits(event)
+
+        event.set_results.assert_called_once_with({
+            "fd-limit": 65536,
+            "instances": 1,
+            "server-connections": 0,
+            "max-client-conn": 65436,
+            "total-max-client-conn": 65436,
+        })
+
+    @patch("charm.PgBouncerCharm._wait_for_instance", return_value=True)
+    @patch("charm.psycopg2.connect")
+    @patch(
+        "charm.PgBouncerCharm._get_client_credentials",
+        return_value={"db1": ("relation_id_1", "pw1")},
+    )
+    @patch(
+        "charm.PgBouncerCharm._get_relation_config",
+        return_value={
+            "db1": {"dbname": "db1"},
+            "db1_readonly": {"dbname": "db1"},
+            "db2": {"dbname": "db2"},
+            "*": {"auth_dbname": "db1"},
+        },
+    )
+    def test_prewarm_pools(self, _get_relation_config, _get_credentials, _connect, _wait):
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"max_db_connections": 8})
+
+        results = self.charm.prewarm_pools()
+
+        # min_pool_size clients hold a transaction on each database with known credentials
+        assert results["instances"] == {
+            "pgbouncer-0": {"databases": 2, "server-connections": 4, "failed-databases": 0}
+        }
+        assert not results["timed-out"]
+        assert results["skipped-databases"] == "db2"
+        assert _connect.call_count == 4
+        _connect.assert_any_call(
+            host=f"{PGB_RUN_DIR}/pgbouncer/instance_0",
+            port=6432,
+            dbname="db1_readonly",
+            user="relation_id_1",
+            password="pw1",
+            connect_timeout=5,
+        )
+        _connect.return_value.cursor().__enter__().execute.assert_called_with("SELECT 1;")
+        assert _connect.return_value.close.call_count == 4
+
+        # Failed logins are reported
+        _connect.reset_mock()
+        _connect.side_effect = psycopg2.OperationalError
+        assert self.charm.prewarm_pools()["instances"]["pgbouncer-0"] == {
+            "databases": 0,
+            "server-connections": 0,
+            "failed-databases": 2,
+        }
+
+        # Instances aren't waited for when there is nothing to warm
+        _wait.reset_mock()
+        _get_credentials.return_value = {}
+        results = self.charm.prewarm_pools()
+        assert not _wait.called
+        assert results["skipped-databases"] == "db1,db2"
+        assert results["instances"]["pgbouncer-0"] == {
+            "databases": 0,
+            "server-connections": 0,
+            "failed-databases": 0,
+        }
+
+    @patch("charm.PgBouncerCharm.prewarm_pools")
+    def test_auto_prewarm_pools(self, _prewarm_pools):
+        # Disabled by default
+        self.charm.auto_prewarm_pools()
+        assert not _prewarm_pools.called
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"prewarm_pools": True})
+        self.charm.auto_prewarm_pools()
+        _prewarm_pools.assert_called_once_with()
+        _prewarm_pools.reset_mock()
+
+        # Invalid config is left for the status to report
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"pool_mode": "bogus"})
+        self.charm.auto_prewarm_pools()
+        assert not _prewarm_pools.called
+
+    @patch("charm.PgBouncerCharm._wait_for_instance", return_value=True)
+    @patch("charm.time.sleep")
+    @patch("charm.PgBouncerCharm._get_main_pid")
+    @patch("charm.systemd")
+    @patch("charm.PgBouncerCharm.admin_console_query")
+    def test_drain_instance(self, _query, _systemd, _get_main_pid, _sleep, _wait):
+        # Clients are waited for from pgbouncer 1.23
+        _query.return_value = [{"version": "PgBouncer 1.23.1"}]
+        _get_main_pid.side_effect = [10, 10, 0]
+
+        assert self.charm.drain_instance("pgbouncer", 0)
+
+        _query.assert_called_with("pgbouncer", 0, "SHUTDOWN WAIT_FOR_CLIENTS;")
+        _systemd.service_restart.assert_called_once_with("pgbouncer-pgbouncer@0")
+        _wait.assert_called_once_with("pgbouncer", 0)
+
+        # Stopped anyway once the timeout expires
+        _systemd.reset_mock()
+        _get_main_pid.side_effect = None
+        _get_main_pid.return_value = 10
+        assert not self.charm.drain_instance("pgbouncer", 0, timeout=0, restart=False)
+        _systemd.service_stop.assert_called_once_with("pgbouncer-pgbouncer@0")
+
+        # Older versions are paused
+        _query.return_value = [{"version": "PgBouncer 1.21.0"}]
+        assert self.charm.drain_instance("pgbouncer", 0, timeout=10)
+        _query.assert_called_with("pgbouncer", 0, "PAUSE;", 10)
+
+    @patch("os.cpu_count", return_value=8)
+    @patch("charm.time.sleep")
+    @patch("charm.PgBouncerCharm._get_cpu_time")
+    @patch("charm.PgBouncerCharm._get_main_pid", side_effect=[10, 11, 12, 0])
+    @patch("charm.PgBouncerCharm.admin_console_query")
+    def test_instance_skew(self, _query, _get_main_pid, _get_cpu_time, _sleep, _):
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"instances_count": "4"})
+        self.charm.service_ids = [0, 1, 2, 3]
+        _get_cpu_time.side_effect = lambda pid: {10: 1.0, 11: 1.0, 12: 1.0}[pid]
+
+        def pools(group, service_id, query):
+            clients = {0: 30, 1: 5, 2: 4}[service_id]
+            return [
+                {"database": "db", "cl_active": clients - 1, "cl_waiting": 1},
+                {"database": "pgbouncer", "cl_active": 1, "cl_waiting": 0},
+            ]
+
+        _query.side_effect = pools
+
+        load = self.charm.sample_instance_load()
+
+        # Stopped instances are left out
+        assert load == {
+            "pgbouncer": {
+                0: {"clients": 30, "cpu": 0.0},
+                1: {"clients": 5, "cpu": 0.0},
+                2: {"clients": 4, "cpu": 0.0},
+            }
+        }
+        assert self.charm.get_load_skew(load["pgbouncer"]) == 30 * 3 / 39
+        _sleep.assert_called_once()
+
+        # Single instances are not sampled for CPU use
+        _sleep.reset_mock()
+        _get_cpu_time.reset_mock()
+        _get_main_pid.side_effect = None
+        _get_main_pid.return_value = 10
+        self.charm.service_ids = [0]
+        assert self.charm.sample_instance_load() == {"pgbouncer": {0: {"clients": 30, "cpu": 0.0}}}
+        assert not _sleep.called
+        assert not _get_cpu_time.called
+        with patch("charm.PgBouncerCharm.sample_instance_load") as _sample_instance_load:
+            self.charm.unit.status = ActiveStatus()
+            self.charm._report_instance_skew()
+            assert not _sample_instance_load.called
+        self.charm.service_ids = [0, 1, 2, 3]
+
+        # Idle groups and single instances aren't skewed
+        assert (
+            self.charm.get_load_skew({
+                0: {"clients": 3, "cpu": 0.0},
+                1: {"clients": 0, "cpu": 0.0},
+            })
+            == 1
+        )
+        assert self.charm.get_load_skew({0: {"clients": 30, "cpu": 1.0}}) == 1
+        # The CPU use counts once busy enough
+        assert (
+            self.charm.get_load_skew({
+                0: {"clients": 0, "cpu": 0.9},
+                1: {"clients": 0, "cpu": 0.1},
+            })
+            == 1.8
+        )
+
+        # Skews over the threshold are added to the active status
+        with patch("charm.PgBouncerCharm.sample_instance_load", return_value=load):
+            self.charm.unit.status = ActiveStatus("VIP: 1.2.3.4")
+            self.charm._report_instance_skew()
+            assert self.charm.unit.status == ActiveStatus("VIP: 1.2.3.4, pgbouncer load skew 2.3x")
+
+            self.charm.unit.status = ActiveStatus()
+            with self.harness.hooks_disabled():
+                self.harness.update_config({"instance_skew_threshold": 2.5})
+            self.charm._report_instance_skew()
+            assert self.charm.unit.status == ActiveStatus()
+
+    @patch(
+        "charm.BackendDatabaseRequires.postgres_databag",
+        new_callable=PropertyMock,
+        return_value={"endpoints": "10.0.0.1:5432", "read-only-endpoints": "10.0.0.2:5432"},
+    )
+    @patch("charm.BackendDatabaseRequires.get_idle_backend_pids")
+    @patch("charm.PgBouncerCharm.admin_console_query")
+    @patch("charm.PgBouncerCharm.sample_instance_load")
+    def test_rebalance_instances(
+        self, _sample_instance_load, _query, _get_idle_backend_pids, _postgres_databag
+    ):
+        # Replica 201 and the unix socket backend 301 share pids with idle primary backends
+        _get_idle_backend_pids.side_effect = lambda pids, host: (
+            {
+                None: {101, 201, 301},
+                "10.0.0.2": {103},
+            }[host]
+            & set(pids)
+        )
+        _sample_instance_load.return_value = {
+            "pgbouncer": {0: {"clients": 12, "cpu": 0.0}, 1: {"clients": 2, "cpu": 0.0}},
+            "pgbouncer-ro": {0: {"clients": 5, "cpu": 0.0}},
+        }
+        clients = [
+            {"id": 1, "database": "db", "state": "active", "link": None},
+            {"id": 2, "database": "db", "state": "waiting", "link": None},
+            # Session clients, idle and running a query
+            {"id": 3, "database": "db", "state": "active", "link": "0x1"},
+            {"id": 4, "database": "db", "state": "active", "link": "0x2"},
+            {"id": 5, "database": "db", "state": "active", "link": None},
+            {"id": 6, "database": "pgbouncer", "state": "active", "link": None},
+            # Readonly session clients, idle and busy on a replica
+            {"id": 7, "database": "db_readonly", "state": "active", "link": "0x3"},
+            {"id": 8, "database": "db_readonly", "state": "active", "link": "0x4"},
+            {"id": 9, "database": "db", "state": "active", "link": "0x5"},
+        ]
+        servers = [
+            {"ptr": "0x1", "addr": "10.0.0.1", "port": 5432, "remote_pid": 101},
+            {"ptr": "0x2", "addr": "10.0.0.1", "port": 5432, "remote_pid": 102},
+            {"ptr": "0x3", "addr": "10.0.0.2", "port": 5432, "remote_pid": 103},
+            {"ptr": "0x4", "addr": "10.0.0.2", "port": 5432, "remote_pid": 201},
+            {"ptr": "0x5", "addr": "unix", "port": 5432, "remote_pid": 301},
+        ]
+        _query.side_effect = lambda group, service_id, query: {
+            "SHOW CLIENTS;": clients,
+            "SHOW SERVERS;": servers,
+        }.get(query, [])
+
+        assert self.charm.rebalance_instances() == {
+            "pgbouncer-0": {"clients": 12, "closed": 4},
+            "pgbouncer-1": {"clients": 2, "closed": 0},
+            "pgbouncer-ro-0": {"clients": 5, "closed": 0},
+        }
+        assert _get_idle_backend_pids.call_args_list == [
+            call([101, 102], None),
+            call([103, 201], "10.0.0.2"),
+        ]
+        assert [args[0][2] for args in _query.call_args_list if "KILL" in args[0][2]] == [
+            "KILL_CLIENT 1;",
+            "KILL_CLIENT 3;",
+            "KILL_CLIENT 5;",
+            "KILL_CLIENT 7;",
+        ]
+        assert all(args[0][:2] == ("pgbouncer", 0) for args in _query.call_args_list)
+
+    @patch("charm.PgBouncerCharm.get_relation_databases")
+    @patch("charm.PgBouncerCharm._reload_pgbouncer")
+    @patch("charm.PgBouncerCharm.render_file")
+    @patch("charm.PgBouncerCharm._get_available_memory", return_value=None)
+    @patch(
+        "charm.BackendDatabaseRequires.postgres_databag",
+        new_callable=PropertyMock,
+        return_value={"endpoints": "HOST:PORT", "read-only-endpoints": "HOST2:PORT"},
+    )
+    @patch(
+        "charm.BackendDatabaseRequires.relation", new_callable=PropertyMock, return_value=Mock()
+    )
+    @patch(
+        "relations.backend_database.DatabaseRequires.fetch_relation_field",
+        return_value="BACKNEND_USER",
+    )
+    @patch(
+        "charm.PgBouncerCharm.conf_auth_file",
+        new_callable=PropertyMock,
+        return_value="/dev/shm/pgbouncer_test",
+    )
+    def test_render_pgb_config_readonly_listener(
+        self,
+        _auth_file,
+        _fetch_field,
+        _backend_rel,
+        _postgres_databag,
+        _,
+        _render,
+        _reload,
+        _get_dbs,
+    ):
+        _get_dbs.return_value = {"1": {"name": "test", "legacy": False}}
+        # Instance groups are set up when the charm is initialised
+        harness = Harness(PgBouncerCharm)
+        self.addCleanup(harness.cleanup)
+        harness.update_config({
+            "readonly_listen_port": 6433,
+            "readonly_instances_count": 1,
+            "readonly_max_db_connections": 20,
+        })
+        harness.begin()
+        self.charm = harness.charm
+        assert self.charm.pgb_services == ["pgbouncer-pgbouncer@0", "pgbouncer-pgbouncer-ro@0"]
+        assert self.charm.listen_ports == [6432, 6433]
+
+        self.charm.render_pgb_config()
+
+        assert _render.call_count == 2
+        primary_path, primary_config, _ = _render.call_args_list[0].args
+        readonly_path, readonly_config, _ = _render.call_args_list[1].args
+        assert primary_path == f"{PGB_CONF_DIR}/pgbouncer/instance_0/pgbouncer.ini"
+        assert "listen_port = 6432" in primary_config
+        assert "test = host=HOST" in primary_config
+        assert "default_pool_size = 50" in primary_config
+        assert readonly_path == f"{PGB_CONF_DIR}/pgbouncer-ro/instance_0/pgbouncer.ini"
+        assert "listen_port = 6433" in readonly_config
+        assert "test = host=HOST" not in readonly_config
+        assert "test_readonly = host=HOST2" in readonly_config
+        assert "default_pool_size = 10" in readonly_config
+        assert f"unix_socket_dir = {PGB_RUN_DIR}/pgbouncer-ro/instance_0" in readonly_config
+
+    @patch("os.path.exists", return_value=True)
+    @patch("charm.PgBouncerCharm.unit_ip", new_callable=PropertyMock, return_value="10.0.0.1")
+    def test_get_backend_host(self, _, _exists):
+        # Disabled by default
+        assert self.charm._get_backend_host("10.0.0.1", "5432") == "10.0.0.1"
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"backend_socket_dir": "/run/postgresql"})
+
+        # Co-located backend
+        assert self.charm._get_backend_host("10.0.0.1", "5432") == "/run/postgresql"
+        _exists.assert_called_once_with("/run/postgresql/.s.PGSQL.5432")
+
+        # Remote backend
+        assert self.charm._get_backend_host("10.0.0.2", "5432") == "10.0.0.2"
+
+        # Missing socket
+        _exists.return_value = False
+        assert self.charm._get_backend_host("10.0.0.1", "5432") == "10.0.0.1"
+
+        # Relative paths are rejected
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"backend_socket_dir": "run/postgresql"})
+        assert not self.charm.configuration_check()
+
     @patch("charm.Peers.app_databag", new_callable=PropertyMock, return_value={})
     @patch("charm.PgBouncerCharm.get_secret")
     def test_get_relation_databases_legacy_data(self, _get_secret, _):
@@ -511,10 +1039,19 @@ class TestCharm(unittest.TestCase):
 
         assert self.charm.generate_relation_databases() == {}
 
+    @patch("charm.PgBouncerCharm._collect_readonly_weights")
+    @patch("charm.PgBouncerCharm._collect_readonly_hosts")
     @patch("charm.PgBouncerCharm._collect_readonly_dbs")
     @patch("charm.PgBouncerCharm.update_status")
     @patch("charm.Peers.update_leader")
-    def test_on_update_status(self, _update_leader, _update_status, _collect_readonly_dbs):
+    def test_on_update_status(
+        self,
+        _update_leader,
+        _update_status,
+        _collect_readonly_dbs,
+        _collect_readonly_hosts,
+        _collect_readonly_weights,
+    ):
         event = Mock()
 
         self.charm._on_update_status(event)
@@ -522,6 +1059,20 @@ class TestCharm(unittest.TestCase):
         _update_leader.assert_called_once_with()
         _update_status.assert_called_once_with()
         _collect_readonly_dbs.assert_called_once_with()
+        _collect_readonly_hosts.assert_called_once_with()
+        _collect_readonly_weights.assert_called_once_with()
+        _collect_readonly_hosts.reset_mock()
+
+        _collect_readonly_weights.reset_mock()
+
+        # The replica lag and routing aren't read from an invalid config
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"pool_mode": "bogus"})
+        self.charm._on_update_status(event)
+
+        assert not _collect_readonly_hosts.called
+        assert not _collect_readonly_weights.called
+        self.assertIsInstance(self.charm.unit.status, BlockedStatus)
 
     @patch(
         "charm.BackendDatabaseRequires.auth_user",
@@ -562,6 +1113,46 @@ class TestCharm(unittest.TestCase):
             }
         }
 
+        # Repeats replicas by weight
+        with self.harness.hooks_disabled():
+            self.harness.update_config({
+                "readonly_routing": "weighted",
+                "readonly_weights": "HOST2=3",
+            })
+        assert (
+            self.charm._get_readonly_dbs({"*": {"name": "*", "auth_dbname": "authdb"}})[
+                "includedb_readonly"
+            ]["host"]
+            == "HOST2,HOST3,HOST2,HOST2"
+        )
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_routing": "round-robin"})
+
+        # Uses the published replicas when filtering by lag
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_max_lag": 10})
+            self.harness.update_relation_data(
+                self.rel_id, self.charm.app.name, {"readonly_hosts": '["HOST3"]'}
+            )
+        assert (
+            self.charm._get_readonly_dbs({"*": {"name": "*", "auth_dbname": "authdb"}})[
+                "includedb_readonly"
+            ]["host"]
+            == "HOST3"
+        )
+
+        # Falls back to the primary if all replicas lag behind
+        with self.harness.hooks_disabled():
+            self.harness.update_relation_data(
+                self.rel_id, self.charm.app.name, {"readonly_hosts": "[]"}
+            )
+        assert (
+            self.charm._get_readonly_dbs({"*": {"name": "*", "auth_dbname": "authdb"}})[
+                "includedb_readonly"
+            ]["host"]
+            == "HOST"
+        )
+
     @patch("charm.BackendDatabaseRequires.postgres")
     @patch(
         "charm.PgBouncerCharm.get_relation_databases", return_value={"1": {"name": "excludeddb"}}
@@ -591,6 +1182,107 @@ class TestCharm(unittest.TestCase):
 
         assert self.charm.peers.app_databag["readonly_dbs"] == '["includeddb"]'
 
+    @patch("charm.PgBouncerCharm.render_pgb_config")
+    @patch(
+        "charm.BackendDatabaseRequires.get_read_only_endpoints",
+        return_value={"HOST2:PORT", "HOST3:PORT", "HOST4:PORT"},
+    )
+    @patch("charm.BackendDatabaseRequires.postgres")
+    def test_collect_readonly_hosts(self, _postgres, _, _render_pgb_config):
+        _fetchall = _postgres._connect_to_database().__enter__().cursor().__enter__().fetchall
+        _fetchall.return_value = (("HOST2", 12.5), ("HOST3", 0.2), ("HOST4", 0))
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_max_lag": 10})
+
+        # don't collect if not leader
+        self.charm._collect_readonly_hosts()
+        assert "readonly_hosts" not in self.charm.peers.app_databag
+
+        with self.harness.hooks_disabled():
+            self.harness.set_leader()
+
+        self.charm._collect_readonly_hosts()
+
+        assert self.charm.peers.app_databag["readonly_hosts"] == '["HOST4", "HOST3"]'
+        _render_pgb_config.assert_called_once_with()
+        _render_pgb_config.reset_mock()
+
+        # don't re-render if unchanged
+        self.charm._collect_readonly_hosts()
+
+        assert not _render_pgb_config.called
+
+        # don't fail if no connection
+        _postgres._connect_to_database().__enter__.side_effect = psycopg2.Error
+
+        self.charm._collect_readonly_hosts()
+
+        assert self.charm.peers.app_databag["readonly_hosts"] == '["HOST4", "HOST3"]'
+
+        # clears the list when disabled
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_max_lag": 0})
+
+        self.charm._collect_readonly_hosts()
+
+        assert "readonly_hosts" not in self.charm.peers.app_databag
+        _render_pgb_config.assert_called_once_with()
+
+    @patch("charm.PgBouncerCharm.render_pgb_config")
+    @patch(
+        "charm.BackendDatabaseRequires.get_read_only_endpoints",
+        return_value={"HOST2:PORT", "HOST3:PORT", "HOST4:PORT"},
+    )
+    @patch("charm.BackendDatabaseRequires.postgres")
+    def test_collect_readonly_weights(self, _postgres, _, _render_pgb_config):
+        backends = {"HOST2": (9,), "HOST3": (19,), "HOST4": (None,)}
+
+        def _connect_to_database(database, database_host):
+            if database_host == "HOST4":
+                raise psycopg2.Error
+            conn = MagicMock()
+            conn.__enter__().cursor().__enter__().fetchone.return_value = backends[database_host]
+            return conn
+
+        _postgres._connect_to_database.side_effect = _connect_to_database
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_routing": "load"})
+
+        # don't collect if not leader
+        self.charm._collect_readonly_weights()
+        assert "readonly_weights" not in self.charm.peers.app_databag
+
+        with self.harness.hooks_disabled():
+            self.harness.set_leader()
+
+        # Unreachable replicas are left with the default weight
+        self.charm._collect_readonly_weights()
+
+        assert self.charm.peers.app_databag["readonly_weights"] == '{"HOST2": 10, "HOST3": 5}'
+        _render_pgb_config.assert_called_once_with()
+        _render_pgb_config.reset_mock()
+        assert self.charm._weighted_hosts(["HOST2", "HOST3", "HOST4"]) == [
+            "HOST2",
+            "HOST3",
+            "HOST4",
+            *["HOST2", "HOST3"] * 4,
+            *["HOST2"] * 5,
+        ]
+
+        # don't re-render if unchanged
+        self.charm._collect_readonly_weights()
+
+        assert not _render_pgb_config.called
+
+        # clears the weights when not routing by load
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"readonly_routing": "round-robin"})
+
+        self.charm._collect_readonly_weights()
+
+        assert "readonly_weights" not in self.charm.peers.app_databag
+        _render_pgb_config.assert_called_once_with()
+
     @patch("charm.HaCluster.relation", new_callable=PropertyMock, return_value=True)
     @patch("charm.PgBouncerCharm._is_exposed", new_callable=PropertyMock, return_value=False)
     @patch(
@@ -684,6 +1376,52 @@ class TestCharm(unittest.TestCase):
 
         assert self.charm.unit.status.message == "VIP: 1.2.3.4"
 
+        # Reports prepared statements state when sharing server connections
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"pool_mode": "transaction"})
+        with patch(
+            "charm.PgBouncerCharm.max_prepared_statements", new_callable=PropertyMock
+        ) as _max_prepared_statements:
+            for max_prepared_statements, message in [
+                (None, "prepared statements unsupported"),
+                (0, "prepared statements disabled"),
+                (200, "prepared statements enabled"),
+            ]:
+                _max_prepared_statements.return_value = max_prepared_statements
+                self.charm.update_status()
+                assert self.charm.unit.status.message == f"VIP: 1.2.3.4, {message}"
+
+    @patch("charm.snap.SnapCache")
+    @patch("charm.subprocess.check_output", return_value=b"PgBouncer 1.21.0\nlibevent 2.1.12\n")
+    def test_version(self, _check_output, _snap_cache):
+        assert self.charm.version == "1.21.0"
+        assert self.charm.version_at_least(1, 21)
+        assert not self.charm.version_at_least(1, 24)
+        _check_output.assert_called_once_with([PGBOUNCER_EXECUTABLE, "--version"])
+
+        # Refreshing the snap drops the cached version
+        _check_output.return_value = b"PgBouncer 1.24.1\n"
+        self.charm._install_snap_packages([("pgbouncer", {"channel": "1/edge"})], refresh=True)
+        assert self.charm.version_at_least(1, 24)
+        assert _check_output.call_count == 2
+
+    @patch("charm.PgBouncerCharm.version", new_callable=PropertyMock, return_value="1.18.0")
+    def test_max_prepared_statements(self, _version):
+        # Not supported by older pgbouncer
+        assert self.charm.max_prepared_statements is None
+
+        # Not needed in session mode
+        _version.return_value = "1.21.0"
+        assert self.charm.max_prepared_statements == 0
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"pool_mode": "transaction"})
+        assert self.charm.max_prepared_statements == 200
+
+        # Unknown version
+        _version.return_value = ""
+        assert self.charm.max_prepared_statements is None
+
     @patch("charm.PgBouncerCharm.config", new_callable=PropertyMock, return_value={})
     def test_configuration_check(self, _config):
         assert self.charm.configuration_check()
@@ -693,6 +1431,396 @@ class TestCharm(unittest.TestCase):
         assert isinstance(self.charm.unit.status, BlockedStatus)
         assert self.charm.unit.status.message == "Configuration Error. Please check the logs"
 
+    @patch("os.cpu_count", return_value=8)
+    @patch("charm.PgBouncerCharm._is_exposed", new_callable=PropertyMock, return_value=False)
+    def test_instances_count(self, _is_exposed, _):
+        # Single instance for local connections
+        assert self.charm.instances_count == 1
+
+        # Unix socket clients are spread over multiple instances
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"local_connection_type": "uds"})
+        assert self.charm.instances_count == 4
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"local_connection_type": "tcp"})
+
+        # Capped at 4 instances when exposed
+        _is_exposed.return_value = True
+        assert self.charm.instances_count == 4
+
+        # Explicit count
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"instances_count": "6"})
+        assert self.charm.instances_count == 6
+
+        # Cannot exceed the CPU cores and falls back to auto
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"instances_count": "9"})
+        assert not self.charm.configuration_check()
+        assert self.charm.instances_count == 4
+
+    @patch("charms.operator_libs_linux.v1.systemd.daemon_reload")
+    @patch("charm.PgBouncerCharm.delete_file")
+    @patch("charm.PgBouncerCharm.render_file")
+    @patch("os.makedirs")
+    @patch("os.path.exists", return_value=False)
+    def test_render_cpu_affinity(self, _exists, _makedirs, _render, _delete, _reload):
+        dropin = "/etc/systemd/system/pgbouncer-pgbouncer@0.service.d/cpu-affinity.conf"
+
+        # Nothing to do when disabled
+        assert not self.charm.render_cpu_affinity()
+        assert not _render.called
+        assert not _reload.called
+
+        # Pins instances to their cores
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"cpu_affinity": True})
+        assert self.charm.render_cpu_affinity()
+        _render.assert_called_once_with(dropin, "[Service]\nCPUAffinity=0\n", perms=0o644)
+        _reload.assert_called_once_with()
+        _reload.reset_mock()
+
+        # Removes existing drop-ins when disabled
+        _exists.return_value = True
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"cpu_affinity": False})
+        assert self.charm.render_cpu_affinity()
+        _delete.assert_called_once_with(dropin)
+        _reload.assert_called_once_with()
+
+    @patch("charms.operator_libs_linux.v1.systemd.daemon_reload")
+    @patch("charm.PgBouncerCharm.delete_file")
+    @patch("charm.PgBouncerCharm.render_file_if_changed", return_value=True)
+    @patch("os.makedirs")
+    @patch("os.path.exists", return_value=False)
+    def test_render_log_sink(self, _exists, _makedirs, _render, _delete, _reload):
+        dropin = "/etc/systemd/system/pgbouncer-pgbouncer@.service.d/log-sink.conf"
+
+        # Nothing to do when logging to files
+        assert not self.charm.render_log_sink()
+        assert not _render.called
+        assert not _reload.called
+
+        # Journald instances are identified by their instance
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_sink": "journald"})
+        assert self.charm.render_log_sink()
+        _render.assert_called_once_with(
+            dropin,
+            "[Service]\nStandardError=journal\nSyslogIdentifier=pgbouncer-pgbouncer-%i\n",
+            perms=0o644,
+        )
+        _reload.assert_called_once_with()
+        _render.reset_mock()
+        _reload.reset_mock()
+
+        # Syslog instances don't log through the journal too
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_sink": "syslog"})
+        assert self.charm.render_log_sink()
+        _render.assert_called_once_with(
+            dropin, "[Service]\nStandardOutput=null\nStandardError=null\n", perms=0o644
+        )
+        _render.reset_mock()
+        _reload.reset_mock()
+
+        # Unchanged drop-ins don't need a restart
+        _render.return_value = False
+        assert not self.charm.render_log_sink()
+        assert not _reload.called
+
+        # Removes existing drop-ins when logging to files
+        _exists.side_effect = lambda path: path == dropin
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_sink": "file"})
+        assert self.charm.render_log_sink()
+        _delete.assert_called_once_with(dropin)
+        _reload.assert_called_once_with()
+
+    def test_log_sink_config(self):
+        with open("templates/pgb_config.j2") as file:
+            template = Template(file.read())
+        kwargs = {
+            "databases": {},
+            "readonly_databases": {},
+            "peers": [],
+            "peer_id": 0,
+            "tuning": {},
+            "logging": {},
+        }
+
+        rendered = template.render(**kwargs, log_file="/var/log/pgbouncer.log")
+        assert "logfile = /var/log/pgbouncer.log\n" in rendered
+        assert "syslog" not in rendered
+
+        rendered = template.render(**kwargs, syslog_ident="pgbouncer-pgbouncer-0")
+        assert "logfile" not in rendered
+        assert "syslog = 1\nsyslog_ident = pgbouncer-pgbouncer-0\n" in rendered
+
+        # Neither a file nor syslog logs to stderr, for the journal
+        rendered = template.render(**kwargs)
+        assert "logfile" not in rendered
+        assert "syslog" not in rendered
+        assert self.charm._log_slots == ["charmed-pgbouncer:logs"]
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_sink": "journald"})
+        assert self.charm._log_slots == []
+
+    @patch("charm.PgBouncerCharm.render_utility_files")
+    @patch("charm.PgBouncerCharm.create_instance_directories")
+    @patch("os.remove", side_effect=FileNotFoundError)
+    @patch("shutil.rmtree")
+    @patch("charms.operator_libs_linux.v1.systemd.service_stop")
+    @patch("os.listdir", return_value=["instance_0", "instance_1", "cert.pem"])
+    @patch("os.path.isdir", side_effect=lambda path: not path.endswith("-ro"))
+    def test_update_instances(
+        self, _isdir, _listdir, _stop, _rmtree, _remove, _create_dirs, _render_utility_files
+    ):
+        # Surplus instances are stopped
+        assert self.charm.update_instances()
+        assert _stop.call_args_list == [
+            call("pgbouncer-pgbouncer-prometheus@1"),
+            call("pgbouncer-pgbouncer@1"),
+        ]
+        _rmtree.assert_any_call(f"{PGB_CONF_DIR}/pgbouncer/instance_1", ignore_errors=True)
+        _create_dirs.assert_called_once_with()
+        _render_utility_files.assert_called_once_with()
+        _stop.reset_mock()
+        _create_dirs.reset_mock()
+
+        # Nothing to do if the instances match
+        _listdir.return_value = ["instance_0"]
+        assert not self.charm.update_instances()
+        assert not _stop.called
+        assert not _create_dirs.called
+
+        # Readonly instances are stopped when the listener is disabled
+        _isdir.side_effect = None
+        _isdir.return_value = True
+        assert self.charm.update_instances()
+        assert _stop.call_args_list == [
+            call("pgbouncer-pgbouncer-ro-prometheus@0"),
+            call("pgbouncer-pgbouncer-ro@0"),
+        ]
+        _rmtree.assert_any_call(f"{PGB_CONF_DIR}/pgbouncer-ro/instance_0", ignore_errors=True)
+        _create_dirs.assert_called_once_with()
+
+        # The unit and directories of the disabled readonly group are always cleaned up
+        _remove.assert_any_call("/etc/systemd/system/pgbouncer-pgbouncer-ro@.service")
+        for path in [PGB_CONF_DIR, PGB_LOG_DIR, PGB_RUN_DIR, SNAP_TMP_DIR]:
+            _rmtree.assert_any_call(f"{path}/pgbouncer-ro", ignore_errors=True)
+        _rmtree.assert_any_call(
+            "/etc/systemd/system/pgbouncer-pgbouncer-ro@.service.d", ignore_errors=True
+        )
+
+        # A leftover readonly unit needs a systemd reload
+        _stop.reset_mock()
+        _create_dirs.reset_mock()
+        _isdir.side_effect = lambda path: not path.endswith("-ro")
+        _remove.side_effect = None
+        assert self.charm.update_instances()
+        assert not _stop.called
+        _create_dirs.assert_called_once_with()
+
+    @patch("charm.PgBouncerCharm.delete_file")
+    @patch("charm.PgBouncerCharm.remove_exporter_service")
+    @patch("os.remove")
+    @patch("shutil.rmtree")
+    @patch("charm.systemd")
+    def test_on_remove(self, _systemd, _rmtree, _remove, _remove_exporter_service, _delete_file):
+        # The readonly instances were disabled before the removal
+        self.charm.readonly_service_ids.clear()
+
+        self.charm._on_remove(None)
+
+        _remove.assert_any_call("/etc/systemd/system/pgbouncer-pgbouncer@.service")
+        _remove.assert_any_call("/etc/systemd/system/pgbouncer-pgbouncer-ro@.service")
+        for path in [PGB_CONF_DIR, PGB_LOG_DIR, PGB_RUN_DIR, SNAP_TMP_DIR]:
+            _rmtree.assert_any_call(f"{path}/pgbouncer")
+            _rmtree.assert_any_call(f"{path}/pgbouncer-ro", ignore_errors=True)
+        _remove_exporter_service.assert_called_once_with()
+        _systemd.daemon_reload.assert_called_once_with()
+
+        # Nothing was left of the readonly group
+        _remove.reset_mock()
+        _rmtree.reset_mock()
+
+        def _remove_missing_readonly(path):
+            if "-ro" in path:
+                raise FileNotFoundError(path)
+
+        _remove.side_effect = _remove_missing_readonly
+        self.charm._on_remove(None)
+        _rmtree.assert_any_call(f"{PGB_CONF_DIR}/pgbouncer-ro", ignore_errors=True)
+
+    @patch("charm.PgBouncerCharm.render_file_if_changed", return_value=True)
+    @patch("charm.systemd")
+    def test_render_logrotate(self, _systemd, _render):
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_max_size": "50M", "log_retention": 3})
+        config_file = unittest.mock.mock_open()
+        real_open = open
+
+        def _open(path, *args, **kwargs):
+            if path.startswith("/etc/"):
+                return config_file(path, *args, **kwargs)
+            return real_open(path, *args, **kwargs)
+
+        with patch("builtins.open", side_effect=_open):
+            self.charm.render_logrotate()
+
+        config_file.assert_called_once_with("/etc/logrotate.d/pgbouncer-pgbouncer", "w+")
+        config = config_file.return_value.write.call_args.args[0]
+        assert "rotate 3\n" in config
+        assert "maxsize 50M\n" in config
+        assert "delaycompress\n" in config
+        # Instances are reloaded one at a time
+        assert config.count("systemctl try-reload-or-restart") == len(self.charm.pgb_services)
+        assert [path for path, *_ in (c.args for c in _render.call_args_list)] == [
+            "/etc/systemd/system/pgbouncer-pgbouncer-logrotate.service",
+            "/etc/systemd/system/pgbouncer-pgbouncer-logrotate.timer",
+        ]
+        _systemd.daemon_reload.assert_called_once_with()
+        _systemd.service_enable.assert_called_once_with(
+            "--now", "pgbouncer-pgbouncer-logrotate.timer"
+        )
+        _systemd.reset_mock()
+
+        # Units are left alone when unchanged
+        _render.return_value = False
+        with patch("builtins.open", side_effect=_open):
+            self.charm.render_logrotate()
+        assert not _systemd.daemon_reload.called
+        assert not _systemd.service_enable.called
+
+        # The size checks are stopped in quiet mode
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_mode": "quiet"})
+        _render.reset_mock()
+        with patch("builtins.open", side_effect=_open):
+            self.charm.render_logrotate()
+        config_file.assert_called_with("/etc/logrotate.d/pgbouncer-pgbouncer", "w+")
+        assert not _render.called
+        _systemd.service_disable.assert_called_once_with(
+            "--now", "pgbouncer-pgbouncer-logrotate.timer"
+        )
+
+        # Nothing to rotate when not logging to files
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_mode": "normal", "log_sink": "journald"})
+        with patch("charm.PgBouncerCharm.delete_file") as _delete:
+            self.charm.render_logrotate()
+        _delete.assert_called_once_with("/etc/logrotate.d/pgbouncer-pgbouncer")
+        assert not _render.called
+
+        # Invalid sizes are rejected
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"log_max_size": "50MB"})
+        _render.reset_mock()
+        self.charm.render_logrotate()
+        assert not _render.called
+
+    @patch("os.cpu_count", return_value=8)
+    @patch("charm.PgBouncerCharm.get_secret", return_value="stats_pass")
+    @patch(
+        "relations.backend_database.BackendDatabaseRequires.stats_user",
+        new_callable=PropertyMock,
+        return_value="stats_user",
+    )
+    @patch("charm.PgBouncerCharm.delete_file")
+    @patch("charm.PgBouncerCharm.render_file_if_changed", return_value=True)
+    @patch("charm.systemd")
+    def test_render_prometheus_service(self, _systemd, _render, _delete, _, __, ___):
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"instances_count": "2", "readonly_listen_port": 6433})
+        self.charm.service_ids = [0, 1]
+        self.charm.readonly_service_ids = [0]
+
+        self.charm.render_prometheus_service()
+
+        with open("templates/prometheus-exporter.service.j2") as file:
+            template = Template(file.read())
+        assert _render.call_args_list == [
+            call(
+                "/etc/systemd/system/pgbouncer-pgbouncer-prometheus@.service",
+                template.render(
+                    env_file=f"{PGB_CONF_DIR}/pgbouncer/prometheus-exporter.env",
+                    pgb_service="pgbouncer-pgbouncer",
+                    socket_dir=f"{PGB_RUN_DIR}/pgbouncer/instance_",
+                    metrics_port=9127,
+                ),
+                perms=0o644,
+            ),
+            call(
+                f"{PGB_CONF_DIR}/pgbouncer/prometheus-exporter.env",
+                'EXPORTER_DSN="postgresql://stats_user:stats_pass@/pgbouncer'
+                '?port=6432&sslmode=disable"\n',
+                perms=0o600,
+            ),
+            call(
+                "/etc/systemd/system/pgbouncer-pgbouncer-ro-prometheus@.service",
+                template.render(
+                    env_file=f"{PGB_CONF_DIR}/pgbouncer-ro/prometheus-exporter.env",
+                    pgb_service="pgbouncer-pgbouncer-ro",
+                    socket_dir=f"{PGB_RUN_DIR}/pgbouncer-ro/instance_",
+                    metrics_port=9129,
+                ),
+                perms=0o644,
+            ),
+            call(
+                f"{PGB_CONF_DIR}/pgbouncer-ro/prometheus-exporter.env",
+                'EXPORTER_DSN="postgresql://stats_user:stats_pass@/pgbouncer'
+                '?port=6433&sslmode=disable"\n',
+                perms=0o600,
+            ),
+        ]
+        _systemd.daemon_reload.assert_called_once_with()
+        assert _systemd.service_restart.call_args_list == [
+            call("pgbouncer-pgbouncer-prometheus@0"),
+            call("pgbouncer-pgbouncer-prometheus@1"),
+            call("pgbouncer-pgbouncer-ro-prometheus@0"),
+        ]
+        assert not _systemd.service_start.called
+        _systemd.reset_mock()
+
+        # Each exporter is scraped on its own port, labelled with its instance
+        assert self.charm._metrics_scrape_configs() == [
+            {
+                "job_name": "pgbouncer",
+                "metrics_path": "/metrics",
+                "static_configs": [
+                    {
+                        "targets": ["localhost:9127"],
+                        "labels": {"pgbouncer_instance": "pgbouncer-0"},
+                    },
+                    {
+                        "targets": ["localhost:9128"],
+                        "labels": {"pgbouncer_instance": "pgbouncer-1"},
+                    },
+                    {
+                        "targets": ["localhost:9129"],
+                        "labels": {"pgbouncer_instance": "pgbouncer-ro-0"},
+                    },
+                ],
+            }
+        ]
+
+        # Unchanged exporters are left running, the readonly ones go away with the listener
+        _render.return_value = False
+        self.charm.readonly_service_ids = []
+        self.charm.render_prometheus_service()
+
+        assert not _systemd.daemon_reload.called
+        assert not _systemd.service_restart.called
+        assert _systemd.service_start.call_args_list == [
+            call("pgbouncer-pgbouncer-prometheus@0"),
+            call("pgbouncer-pgbouncer-prometheus@1"),
+        ]
+        assert _delete.call_args_list == [
+            call("/etc/systemd/system/pgbouncer-pgbouncer-ro-prometheus@.service"),
+            call(f"{PGB_CONF_DIR}/pgbouncer-ro/prometheus-exporter.env"),
+        ]
+
     #
     # Secrets
     #
@@ -0,0 +1,105 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import glob
+import json
+import re
+
+import jsonschema
+import pytest
+
+DASHBOARDS = glob.glob("src/grafana_dashboards/*.json")
+
+TARGET_SCHEMA = {
+    "type": "object",
+    "required": ["expr", "refId"],
+    "properties": {"expr": {"type": "string", "minLength": 1}, "refId": {"type": "string"}},
+}
+GRID_POS_SCHEMA = {
+    "type": "object",
+    "required": ["h", "w", "x", "y"],
+    "properties": {
+        "h": {"type": "integer", "minimum": 1},
+        "w": {"type": "integer", "minimum": 1, "maximum": 24},
+        "x": {"type": "integer", "minimum": 0, "maximum": 23},
+        "y": {"type": "integer", "minimum": 0},
+    },
+}
+DASHBOARD_SCHEMA = {
+    "type": "object",
+    "required": ["panels", "templating", "title", "uid", "schemaVersion", "__requires"],
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "uid": {"type": "string", "minLength": 1},
+        "panels": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["id", "type", "title", "gridPos"],
+                "properties": {
+                    "id": {"type": "integer"},
+                    "type": {"type": "string"},
+                    "title": {"type": "string", "minLength": 1},
+                    "gridPos": GRID_POS_SCHEMA,
+                    "targets": {"type": "array", "items": TARGET_SCHEMA},
+                },
+            },
+        },
+        "templating": {
+            "type": "object",
+            "required": ["list"],
+            "properties": {
+                "list": {
+                    "type": "array",
+                    "items": {"type": "object", "required": ["name", "type"]},
+                }
+            },
+        },
+    },
+}
+
+
+def _load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+@pytest.mark.parametrize("path", DASHBOARDS)
+def test_dashboard_schema(path):
+    jsonschema.validate(_load(path), DASHBOARD_SCHEMA)
+
+
+@pytest.mark.parametrize("path", DASHBOARDS)
+def test_dashboard_lint(path):
+    dashboard = _load(path)
+    panels = dashboard["panels"]
+    variables = {variable["name"] for variable in dashboard["templating"]["list"]}
+    required_panels = {
+        required["id"] for required in dashboard["__requires"] if required["type"] == "panel"
+    }
+
+    assert len({panel["id"] for panel in panels}) == len(panels), "Duplicate panel ids"
+
+    cells = {}
+    for panel in panels:
+        grid = panel["gridPos"]
+        assert grid["x"] + grid["w"] <= 24, panel["title"]
+        # Panels don't overlap
+        for x in range(grid["x"], grid["x"] + grid["w"]):
+            for y in range(grid["y"], grid["y"] + grid["h"]):
+                assert (x, y) not in cells, f"{panel['title']} overlaps {cells[(x, y)]}"
+                cells[(x, y)] = panel["title"]
+
+        if panel["type"] == "row":
+            continue
+        assert panel["type"] in required_panels, panel["title"]
+        assert panel["datasource"]["uid"] == "${prometheusds}", panel["title"]
+        ref_ids = [target["refId"] for target in panel["targets"]]
+        assert len(set(ref_ids)) == len(ref_ids), panel["title"]
+        for target in panel["targets"]:
+            expr = target["expr"]
+            assert expr.count("(") == expr.count(")"), panel["title"]
+            assert expr.count("{") == expr.count("}"), panel["title"]
+            # Every variable in the queries is defined, regex groups aside
+            for variable in re.findall(r"\$([A-Za-z_]\w*)", expr):
+                assert variable in variables, f"{panel['title']} uses undefined ${variable}"
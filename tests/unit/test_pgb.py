@@ -0,0 +1,56 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from base64 import b64decode
+
+import pytest
+from charms.pgbouncer_k8s.v0.pgb import UserList, _saslprep, get_scram_password
+
+
+def test_get_scram_password():
+    # Test vector from RFC 7677, in the format PostgreSQL stores in pg_authid
+    assert (
+        get_scram_password("user", "pencil", salt=b64decode("W22ZaJ0SNY7soEsUEjb6gQ=="))
+        == "SCRAM-SHA-256$4096:W22ZaJ0SNY7soEsUEjb6gQ==$"
+        "WG5d8oPm3OtcPnkdi4Uo7BkeZkBFzpcXkuLmtbsT4qY=:wfPLwcE6nTWhTAmQ7tl2KeoiWGPlZqQxSrmfPwDl2dU="
+    )
+
+    # Random salts
+    first = get_scram_password("user", "pencil")
+    second = get_scram_password("user", "pencil")
+    assert first != second
+    assert len(b64decode(first.split("$")[1].split(":")[1])) == 16
+
+
+def test_saslprep():
+    # RFC 4013 examples
+    assert _saslprep("I\u00adX") == "IX"
+    assert _saslprep("user") == "user"
+    assert _saslprep("\u00aa") == "a"
+    assert _saslprep("\u2168") == "IX"
+    assert _saslprep("a\u200bb") == "ab"
+    # Prohibited characters and bidi errors fall back to the raw password, like PostgreSQL does
+    assert _saslprep("\u00e9\u0007") == "\u00e9\u0007"
+    assert _saslprep("\u06271") == "\u06271"
+
+
+def test_userlist():
+    content = '"auth_user" "md5hash"\n"quoted""user" "SCRAM-SHA-256$4096:salt$keys"'
+    userlist = UserList.parse(content)
+
+    assert list(userlist) == ["auth_user", 'quoted"user']
+    assert userlist.get("auth_user") == "md5hash"
+    assert "missing" not in userlist
+    assert str(userlist) == content
+    assert UserList.parse(f"\n{content}\n") == userlist
+
+    updated = UserList.parse(content)
+    updated.add("relation_id_1", "scram")
+    updated.add("auth_user", "scram")
+    updated.remove('quoted"user')
+    updated.remove("missing")
+    assert userlist.diff(updated) == ({"relation_id_1"}, {'quoted"user'}, {"auth_user"})
+    assert userlist.diff(UserList.parse(content)) == (set(), set(), set())
+
+    with pytest.raises(ValueError):
+        UserList.parse('"auth_user"')
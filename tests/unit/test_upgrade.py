@@ -1,11 +1,13 @@
 # Copyright 2023 Canonical Ltd.
 # See LICENSE file for licensing details.
 import unittest
-from unittest.mock import Mock, PropertyMock, patch
+from unittest.mock import Mock, PropertyMock, call, patch
 
+import psycopg2
 import pytest
 import tenacity
 from charms.data_platform_libs.v0.upgrade import ClusterNotReadyError
+from charms.operator_libs_linux.v2 import snap
 from ops.testing import Harness
 
 from charm import PgBouncerCharm
@@ -101,6 +103,83 @@ class TestUpgrade(unittest.TestCase):
         _on_upgrade_changed.assert_called_once_with(event)
         _generate_relation_databases.assert_called_once_with()
 
+    @patch("charm.PgBouncerCharm.update_instances")
+    @patch("charm.PgBouncerCharm.drain_instance")
+    @patch("charm.PgBouncerCharm.render_pgb_config")
+    @patch("charm.PgBouncerCharm.create_instance_directories")
+    @patch("charm.PgBouncerCharm._install_snap_packages")
+    @patch("upgrade.systemd")
+    def test_rolling_upgrade(
+        self,
+        _systemd: Mock,
+        _install_snap_packages: Mock,
+        _create_instance_directories: Mock,
+        _render_pgb_config: Mock,
+        _drain_instance: Mock,
+        _update_instances: Mock,
+    ):
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"upgrade_strategy": "rolling"})
+
+        # The snap is refreshed under the running instances
+        assert self.charm.upgrade._refresh_snap(True)
+        assert not _systemd.service_stop.called
+        _install_snap_packages.assert_called_once_with(packages=SNAP_PACKAGES, refresh=True)
+
+        # A handoff instance takes new connections while the only instance drains
+        with patch("upgrade.time.monotonic", side_effect=[100, 100, 250, 250]):
+            self.charm.upgrade._rolling_restart()
+
+        assert _drain_instance.call_args_list == [
+            call("pgbouncer", 0, 300),
+            call("pgbouncer", 1, 300, restart=False),
+        ]
+        assert self.charm.service_ids == [0]
+        _create_instance_directories.assert_called_once_with()
+        assert _render_pgb_config.call_count == 2
+        _update_instances.assert_called_once_with()
+        _drain_instance.reset_mock()
+
+        # The drain timeout is configurable
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"upgrade_drain_timeout": 60})
+        with patch("upgrade.time.monotonic", side_effect=[100, 100, 130, 130]):
+            self.charm.upgrade._rolling_restart()
+        assert _drain_instance.call_args_list == [
+            call("pgbouncer", 0, 60),
+            call("pgbouncer", 1, 60, restart=False),
+        ]
+        _drain_instance.reset_mock()
+
+        # The instances share the drain timeout
+        self.charm.service_ids.append(1)
+        with patch("upgrade.time.monotonic", side_effect=[100, 100, 160, 220]):
+            self.charm.upgrade._rolling_restart()
+        assert _drain_instance.call_args_list == [
+            call("pgbouncer", 0, 60),
+            call("pgbouncer", 1, 0),
+        ]
+        self.charm.service_ids.remove(1)
+        _drain_instance.reset_mock()
+
+        # The handoff instances get their own deadline once the others used it up
+        self.charm.readonly_service_ids.append(0)
+        with patch("upgrade.time.monotonic", side_effect=[100, 100, 160, 200, 200, 230]):
+            self.charm.upgrade._rolling_restart()
+        assert _drain_instance.call_args_list == [
+            call("pgbouncer", 0, 60),
+            call("pgbouncer-ro", 0, 0),
+            call("pgbouncer", 1, 60, restart=False),
+            call("pgbouncer-ro", 1, 30, restart=False),
+        ]
+        self.charm.readonly_service_ids.clear()
+
+        # Falls back to stopping the instances if snapd refuses to refresh
+        _install_snap_packages.side_effect = [snap.SnapError, None]
+        _systemd.service_running.return_value = True
+        assert not self.charm.upgrade._refresh_snap(True)
+        _systemd.service_stop.assert_called_once_with("pgbouncer-pgbouncer@0")
+
     @patch("charm.PgBouncerCharm.render_pgb_config")
     @patch("charm.PgBouncerCharm.get_secret")
     @patch("upgrade.wait_fixed", return_value=tenacity.wait_fixed(0))
@@ -137,11 +216,68 @@ class TestUpgrade(unittest.TestCase):
         with pytest.raises(ClusterNotReadyError):
             self.charm.upgrade._on_upgrade_granted(Mock())
 
+    @patch("charm.BackendDatabaseRequires.ready", return_value=True, new_callable=PropertyMock)
+    @patch("charm.BackendDatabaseRequires.postgres", new_callable=PropertyMock)
+    @patch("charm.BackendDatabaseRequires.get_longest_transaction", return_value=12.34)
+    @patch("charm.PgBouncerCharm.admin_console_query")
     @patch("charm.PgBouncerCharm.check_pgb_running", return_value=True)
-    def test_pre_upgrade_check(self, _check_pgb_running: Mock):
+    def test_pre_upgrade_check(
+        self,
+        _check_pgb_running: Mock,
+        _admin_console_query: Mock,
+        _get_longest_transaction: Mock,
+        _postgres: Mock,
+        _,
+    ):
+        _admin_console_query.side_effect = [
+            [
+                {"database": "db", "cl_active": 3, "cl_waiting": 1, "sv_active": 2},
+                {"database": "pgbouncer", "cl_active": 1, "cl_waiting": 0, "sv_active": 0},
+            ],
+            [{"database": "db"}] * 4 + [{"database": "pgbouncer"}],
+        ]
+
         self.charm.upgrade.pre_upgrade_check()
 
         _check_pgb_running.assert_called_once_with()
+        assert _admin_console_query.call_args_list == [
+            call("pgbouncer", 0, "SHOW POOLS;"),
+            call("pgbouncer", 0, "SHOW CLIENTS;"),
+        ]
+        assert self.charm.upgrade.pool_state == {
+            "instances": {
+                "pgbouncer-0": {
+                    "pools": 1,
+                    "clients": 4,
+                    "active-clients": 3,
+                    "waiting-clients": 1,
+                    "active-servers": 2,
+                }
+            },
+            "longest-transaction": 12.3,
+        }
+
+    @patch("charm.PgBouncerCharm.admin_console_query")
+    @patch("upgrade.systemd")
+    def test_stop_services_drain(self, _systemd: Mock, _admin_console_query: Mock):
+        _systemd.service_running.return_value = True
+
+        self.charm.upgrade._stop_services()
+
+        assert not _admin_console_query.called
+        _systemd.service_stop.assert_called_once_with("pgbouncer-pgbouncer@0")
+        _systemd.service_stop.reset_mock()
+
+        # In-flight transactions get to finish before the instances are stopped
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"upgrade_drain_timeout": 60})
+        _admin_console_query.side_effect = psycopg2.OperationalError
+        self.charm.upgrade._stop_services()
+
+        _admin_console_query.assert_called_once()
+        assert _admin_console_query.call_args[0][:3] == ("pgbouncer", 0, "PAUSE;")
+        assert 0 < _admin_console_query.call_args[0][3] <= 60
+        _systemd.service_stop.assert_called_once_with("pgbouncer-pgbouncer@0")
 
     @patch("charm.PgBouncerCharm.check_pgb_running", return_value=False)
     def test_pre_upgrade_check_not_ready(self, _check_pgb_running: Mock):